@@ -0,0 +1,250 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015-2016, Xuyang Hu <xuyanghu@yahoo.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License version 2.1
+# as published by the Free Software Foundation
+
+"""
+batchCli runs the batch processing from the command line, without Qt
+and without opening any window, and writes the metrics to files.
+
+Usage:
+    python batchCli.py --roi 10,10,200,200 --metrics center,entropy \\
+        --workers 4 --format csv --output results/ folder1 folder2
+
+One output is written per folder, named after the folder: a CSV with
+one row per image, or one .npy file per metric (rows are images, the
+file names are listed in <name>_files.txt), or a single .npz.
+"""
+
+import argparse
+import csv
+import os
+import sys
+
+import numpy as np
+
+import batchProcesser
+import batchPipeline
+import imageMetrics
+import imageStack
+from imageCache import FilteredImageCache
+from imageSampling import SampleGrid
+
+# pylint: disable=C0103,R0904,W0102,W0201
+
+defaultMetrics = 'center,centerWithoutShift,average,entropy'
+formats = ('csv', 'npy', 'npz')
+
+def parseInts(text, count=None):
+    """
+    Parse a comma separated list of integers for argparse.
+    """
+    try:
+        values = tuple(int(v) for v in text.split(','))
+    except ValueError:
+        raise argparse.ArgumentTypeError("not a list of integers: " + text)
+    if count is not None and len(values) not in count:
+        raise argparse.ArgumentTypeError("expected %s integers: %s" % (
+            ' or '.join(str(c) for c in count), text))
+    return values
+
+def parseArgs(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Measure all the images of folders and write the "
+            "results to files.")
+    parser.add_argument('folders', nargs='+',
+        help="image folders or stack files (.npy, or raw with a .json "
+            "description, see imageStack)")
+    parser.add_argument('--roi', type=lambda t: parseInts(t, (4,)),
+        metavar='MINX,MINY,MAXX,MAXY', help="process only this rect")
+    parser.add_argument('--stopband2', type=int, default=5,
+        help="stopband^2 of the Butterworth blur (default: 5)")
+    parser.add_argument('--metrics', default=defaultMetrics,
+        help="comma separated list of %s (default: %s)" % (
+            ', '.join(imageMetrics.METRICS), defaultMetrics))
+    parser.add_argument('--col', type=lambda t: parseInts(t, (1, 2)),
+        default=(), metavar='LOC[,COUNT]',
+        help="x and number of points of the 'col' metric")
+    parser.add_argument('--row', type=lambda t: parseInts(t, (1, 2)),
+        default=(), metavar='LOC[,COUNT]',
+        help="y and number of points of the 'row' metric")
+    parser.add_argument('--grid', type=lambda t: parseInts(t, (2, 3)),
+        default=(10, 10), metavar='XCOUNT,YCOUNT[,SIZE]',
+        help="even grid of the 'samples' metric (default: 10,10)")
+    parser.add_argument('--decode-scale', type=int, choices=(1, 2, 4, 8),
+        default=1, dest='decodeScale',
+        help="decode the images at 1/N of their size, the ROI is still "
+            "given in full size pixels (default: 1)")
+    parser.add_argument('--block-size', type=int, default=1,
+        dest='blockSize', metavar='N',
+        help="filter and measure the images N at a time, they must all "
+            "have the same size (default: 1)")
+    parser.add_argument('--workers', type=int, default=1,
+        help="number of worker processes (default: 1)")
+    parser.add_argument('--prefetch', type=int, default=0, metavar='N',
+        help="read and decode up to N images ahead in threads while one "
+            "is filtered, with a single worker (default: 0, off)")
+    parser.add_argument('--cache', metavar='DIR',
+        help="keep the filtered images in this directory between runs")
+    parser.add_argument('--format', choices=formats, default='csv',
+        help="output format (default: csv)")
+    parser.add_argument('--output', default='.', metavar='DIR',
+        help="output directory (default: current directory)")
+    parser.add_argument('--timing', action='store_true',
+        help="print the time spent in each stage of the batch")
+    parser.add_argument('--profile', action='store_true',
+        help="profile the runs with cProfile, the stats are saved next "
+            "to the results as <name>.prof")
+    parser.add_argument('--quiet', action='store_true',
+        help="do not report the progress on stderr")
+
+    args = parser.parse_args(argv)
+    args.metrics = [name for name in args.metrics.split(',') if name]
+    for name in args.metrics:
+        if name not in imageMetrics.METRICS:
+            parser.error("unknown metric: " + name)
+    for folder in args.folders:
+        if not os.path.isdir(folder) and not imageStack.isStackFile(folder):
+            parser.error("not a folder or a stack file: " + folder)
+    if args.workers < 1:
+        parser.error("--workers must be at least 1")
+    if args.prefetch < 0:
+        parser.error("--prefetch must not be negative")
+    return args
+
+def makePlan(args, batch):
+    """
+    Return the imageMetrics.measureAll plan of the arguments.
+    """
+    plan = {}
+    for name in args.metrics:
+        if name == 'col':
+            plan[name] = args.col
+        elif name == 'row':
+            plan[name] = args.row
+        elif name == 'samples':
+            # The grid is spread over the (ROI of the) first image
+            if batch.stack is not None:
+                shape = batch.stack.getFrame(0, args.roi).shape
+            else:
+                shape = batchPipeline.loadImage(batch.listPaths[0], args.roi,
+                    args.decodeScale).shape
+            plan[name] = (SampleGrid.fromEvenGrid(shape, *args.grid),)
+        else:
+            plan[name] = ()
+    return plan
+
+def getMetricTable(column, count):
+    """
+    Return a column of MetricResults as an array with one row per image.
+    """
+    return column.reshape(count, -1)
+
+def getColumnNames(name, table):
+    if table.shape[1] == 1:
+        return [name]
+    return ['%s_%d' % (name, i) for i in range(table.shape[1])]
+
+def writeResults(outputPath, fileFormat, fileNames, tables):
+    """
+    Write the tables [(metric name, table)] of a folder.
+
+    @param  outputPath  path of the output without extension
+    @return             list of the written files
+    """
+    if fileFormat == 'csv':
+        path = outputPath + '.csv'
+        with open(path, 'wb') as f:
+            writer = csv.writer(f)
+            header = ['file']
+            for name, table in tables:
+                header.extend(getColumnNames(name, table))
+            writer.writerow(header)
+            for i, fileName in enumerate(fileNames):
+                row = [fileName]
+                for name, table in tables:
+                    row.extend(repr(v) for v in table[i].tolist())
+                writer.writerow(row)
+        return [path]
+
+    if fileFormat == 'npz':
+        path = outputPath + '.npz'
+        np.savez(path, files=np.array(fileNames), **dict(tables))
+        return [path]
+
+    paths = [outputPath + '_files.txt']
+    with open(paths[0], 'w') as f:
+        f.write(''.join(fileName + '\n' for fileName in fileNames))
+    for name, table in tables:
+        paths.append('%s_%s.npy' % (outputPath, name))
+        np.save(paths[-1], table)
+    return paths
+
+def reportProgress(done, total):
+    sys.stderr.write('\r%d/%d' % (done, total))
+    if done == total:
+        sys.stderr.write('\n')
+    sys.stderr.flush()
+
+def processFolder(args, folder, outputPath, cache):
+    """
+    Measure the images of folder and write the results.
+
+    @return     list of the written files
+    """
+    batch = batchProcesser.BatchProcessing(rootPath=folder, roi=args.roi,
+        streaming=True, workers=args.workers, cache=cache,
+        progress=None if args.quiet else reportProgress,
+        stopband2=args.stopband2, timing=args.timing,
+        profile=args.profile, decodeScale=args.decodeScale,
+        blockSize=args.blockSize, prefetch=args.prefetch)
+    try:
+        count = len(batch.listPaths)
+        if count == 0:
+            results = {}
+        else:
+            plan = makePlan(args, batch)
+            results = batch.measureResults(plan)
+    finally:
+        batch.close()
+    tables = [(name, getMetricTable(results[name], count))
+        for name in args.metrics if name in results]
+    paths = writeResults(outputPath, args.format, batch.listFileNames, tables)
+    if batch.getProfileStats() is not None:
+        paths.append(outputPath + '.prof')
+        batch.getProfileStats().dump_stats(paths[-1])
+    return paths
+
+def main(argv=None):
+    args = parseArgs(argv)
+    if not os.path.isdir(args.output):
+        os.makedirs(args.output)
+    cache = FilteredImageCache(args.cache) if args.cache else None
+
+    usedNames = set()
+    for folder in args.folders:
+        name = os.path.basename(os.path.abspath(folder)) or 'root'
+        if imageStack.isStackFile(folder):
+            name = os.path.splitext(name)[0]
+        outputName = name
+        index = 2
+        while outputName in usedNames:
+            outputName = '%s_%d' % (name, index)
+            index += 1
+        usedNames.add(outputName)
+
+        paths = processFolder(args, folder,
+            os.path.join(args.output, outputName), cache)
+        for path in paths:
+            sys.stderr.write("Written " + path + "\n")
+    if cache is not None:
+        sys.stderr.write("Cache: %(hits)d hits, %(misses)d misses\n"
+            % cache.getStats())
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,364 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015-2016, Xuyang Hu <xuyanghu@yahoo.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License version 2.1
+# as published by the Free Software Foundation
+
+"""
+batchPipeline loads and filters the images of a batch one at a time.
+
+Every stage is a plain function or generator, so only the image being
+processed is kept in memory. The same stages run in worker processes
+when a pool is given to mapImages.
+
+Frames of a memory mapped imageStack.ImageStack go through the same
+stages without the decoding, see mapFrames. mapBlocks filters images of
+the same shape into one (N, height, width) block and measures the block
+at once, which saves the per image Python overhead of the metrics.
+"""
+
+from itertools import chain, imap, izip
+
+import cv2
+import numpy as np
+
+from frequencyFilter import defaultEngine
+from stageTimer import StageTimer
+
+# pylint: disable=C0103,R0904,W0102,W0201
+
+# cv2.imread flags decoding at 1/scale of the size, OpenCV >= 3.2 only
+reducedFlags = {1: 0}
+for scale in (2, 4, 8):
+    if hasattr(cv2, 'IMREAD_REDUCED_GRAYSCALE_%d' % scale):
+        reducedFlags[scale] = getattr(cv2,
+            'IMREAD_REDUCED_GRAYSCALE_%d' % scale)
+
+def decodeImage(path, scale=1):
+    """
+    Load the image in gray scale at 1/scale of its size.
+
+    JPEG images are decoded at the reduced size directly (DCT scaling),
+    which is much faster than decoding the full frame.
+
+    @param  scale   1, 2, 4 or 8
+    """
+    flag = reducedFlags.get(scale)
+    if flag is not None:
+        return cv2.imread(path, flag)
+    img = cv2.imread(path, 0)
+    if img is not None and scale != 1:
+        img = cv2.resize(img, (-(-img.shape[1] // scale),
+            -(-img.shape[0] // scale)), interpolation=cv2.INTER_AREA)
+    return img
+
+def getScaledROI(roi, scale=1):
+    """
+    Return the ROI (minX, minY, maxX, maxY) in an image decoded at
+    1/scale of its size.
+    """
+    if scale == 1:
+        return roi
+    return (roi[0] // scale, roi[1] // scale, -(-roi[2] // scale),
+        -(-roi[3] // scale))
+
+def loadImage(path, roi=None, scale=1, timer=None):
+    """
+    Load the image in gray scale and cut the ROI out of it.
+
+    The ROI is copied into its own compact buffer, so the full frame is
+    freed as soon as this returns and the filter only runs on the ROI.
+
+    @param  roi     (minX, minY, maxX, maxY) or None for the full image,
+                    in the coordinates of the full size image
+    @param  scale   decode at 1/scale of the size, see decodeImage
+    @param  timer   stageTimer.StageTimer or None
+    """
+    if timer is not None:
+        t = timer.start()
+    img = decodeImage(path, scale)
+    if img is None:
+        raise IOError("Cannot decode the image " + path)
+    if timer is not None:
+        t = timer.stop('decode', t)
+    if roi:
+        roi = getScaledROI(roi, scale)
+        img = img[roi[1]:roi[3], roi[0]:roi[2]].copy()
+        if timer is not None:
+            timer.stop('roi', t)
+    return img
+
+def filterImage(img, stopband2=5, timer=None, dst=None):
+    """
+    Apply the batch filter (Butterworth blur) to image.
+
+    @param  dst     uint8 array to write the result into, or None
+    """
+    return defaultEngine.getButterworthBlur(img, stopband2=stopband2,
+        dst=dst, timer=timer)
+
+def loadFilteredImage(path, roi=None, stopband2=5, cache=None, timer=None,
+        scale=1):
+    """
+    Return the filtered ROI of the image, through the cache when given.
+
+    @param  cache   imageCache.FilteredImageCache or None
+    @param  timer   stageTimer.StageTimer or None
+    @param  scale   see loadImage
+    """
+    if cache is not None:
+        if timer is not None:
+            t = timer.start()
+        img = cache.get(path, roi, stopband2, scale)
+        if timer is not None:
+            timer.stop('cacheRead', t)
+        if img is not None:
+            return img
+    img = filterImage(loadImage(path, roi, scale, timer), stopband2, timer)
+    if cache is not None:
+        if timer is not None:
+            t = timer.start()
+        cache.put(path, img, roi, stopband2, scale)
+        if timer is not None:
+            timer.stop('cacheWrite', t)
+    return img
+
+def readImage(path, roi=None, stopband2=5, cache=None, scale=1):
+    """
+    Return (filtered image from the cache, True) or (ROI of the image
+    to filter, False). Reads only, so it can run in prefetch threads.
+    """
+    if cache is not None:
+        img = cache.load(path, roi, stopband2, scale)
+        if img is not None:
+            return img, True
+    return loadImage(path, roi, scale), False
+
+def iterFilteredImages(paths, roi=None, stopband2=5, cache=None, timer=None,
+        scale=1, prefetcher=None):
+    """
+    Yield the filtered images of paths one by one, in order.
+
+    @param  prefetcher  prefetcher.Prefetcher reading the next images
+                        while one is filtered, or None
+    """
+    if prefetcher is None:
+        for path in paths:
+            yield loadFilteredImage(path, roi, stopband2, cache, timer, scale)
+        return
+
+    reads = prefetcher.imap(
+        lambda path: readImage(path, roi, stopband2, cache, scale), paths)
+    for path, ((img, isFiltered), seconds) in izip(paths, reads):
+        if timer is not None:
+            timer.add('cacheRead' if isFiltered else 'decode', seconds)
+        if cache is not None:
+            if isFiltered:
+                cache.hits += 1
+                yield img
+                continue
+            cache.misses += 1
+        img = filterImage(img, stopband2, timer)
+        if cache is not None:
+            if timer is not None:
+                t = timer.start()
+            cache.put(path, img, roi, stopband2, scale)
+            if timer is not None:
+                timer.stop('cacheWrite', t)
+        yield img
+
+def measureImage(task):
+    """
+    Load, filter and measure one image.
+
+    This is the task run by the worker processes, so only the image
+    shape and the (small) measured value are sent back. The cache hit,
+    the bytes written to the cache and the stage times are reported too
+    since the counters of the worker copies of the cache are lost.
+
+    @param  task    (path, roi, stopband2, func, args, cache, timing,
+                    scale), func is called as func(img, *args) and must
+                    be picklable, the stages are timed when timing is
+                    True, see loadImage for scale
+    @return (shape, value, cacheResult, times), cacheResult is None
+            without cache, else (cacheHit, bytes written to the cache),
+            times is the getTimes() of a stageTimer.StageTimer or None
+    """
+    path, roi, stopband2, func, args, cache, timing, scale = task
+    timer = StageTimer() if timing else None
+    counts = getCacheCounts(cache)
+    img = loadFilteredImage(path, roi, stopband2, cache, timer, scale)
+    cacheResult = getCacheResult(cache, counts)
+    if timer is not None:
+        t = timer.start()
+    value = func(img, *args)
+    if timer is not None:
+        timer.stop('metrics', t)
+        return img.shape, value, cacheResult, timer.getTimes()
+    return img.shape, value, cacheResult, None
+
+def getCacheCounts(cache):
+    """
+    Return the (hits, writtenBytes) counters of cache, or None.
+    """
+    if cache is None:
+        return None
+    return cache.hits, cache.writtenBytes
+
+def getCacheResult(cache, counts):
+    """
+    Return (cacheHit, bytes written) since getCacheCounts gave counts,
+    or None without cache.
+    """
+    if cache is None:
+        return None
+    hits, writtenBytes = counts
+    return cache.hits > hits, cache.writtenBytes - writtenBytes
+
+def mapImages(paths, func, args=(), roi=None, stopband2=5, pool=None,
+        chunkSize=1, cache=None, timing=False, scale=1):
+    """
+    Yield (shape, func(img, *args), cacheResult, times) of the filtered
+    images in file order, see measureImage.
+
+    @param  pool        multiprocessing.Pool to spread the images over,
+                        or None to process them in this process
+    @param  chunkSize   number of images sent to a worker at once
+    @param  cache       imageCache.FilteredImageCache or None
+    @param  timing      time the stages of every image
+    @param  scale       decode at 1/scale of the size, see loadImage
+    """
+    tasks = ((path, roi, stopband2, func, args, cache, timing, scale)
+        for path in paths)
+    if pool is None:
+        return imap(measureImage, tasks)
+    return pool.imap(measureImage, tasks, chunkSize)
+
+def loadFrame(stack, index, roi=None, timer=None):
+    """
+    Return the ROI of a frame of an imageStack.ImageStack.
+    """
+    if timer is not None:
+        t = timer.start()
+    img = stack.getFrame(index, roi)
+    if timer is not None:
+        timer.stop('roi', t)
+    return img
+
+def iterFilteredFrames(stack, indices, roi=None, stopband2=5, timer=None):
+    """
+    Yield the filtered frames of stack one by one, in order.
+    """
+    for index in indices:
+        yield filterImage(loadFrame(stack, index, roi, timer), stopband2,
+            timer)
+
+def measureFrame(task):
+    """
+    Filter and measure one frame of a stack, like measureImage.
+
+    @param  task    (stack, index, roi, stopband2, func, args, timing)
+    @return (shape, value, None, times)
+    """
+    stack, index, roi, stopband2, func, args, timing = task
+    timer = StageTimer() if timing else None
+    img = filterImage(loadFrame(stack, index, roi, timer), stopband2, timer)
+    if timer is not None:
+        t = timer.start()
+    value = func(img, *args)
+    if timer is not None:
+        timer.stop('metrics', t)
+        return img.shape, value, None, timer.getTimes()
+    return img.shape, value, None, None
+
+def mapFrames(stack, indices, func, args=(), roi=None, stopband2=5,
+        pool=None, chunkSize=1, timing=False):
+    """
+    Yield (shape, func(img, *args), None, times) of the filtered frames
+    of stack in order, see mapImages. Only the name and the layout of
+    the stack are sent to the workers, which map the file themselves.
+    """
+    tasks = ((stack, index, roi, stopband2, func, args, timing)
+        for index in indices)
+    if pool is None:
+        return imap(measureFrame, tasks)
+    return pool.imap(measureFrame, tasks, chunkSize)
+
+def loadFilteredBlock(paths, roi=None, stopband2=5, cache=None, timer=None,
+        scale=1, stack=None):
+    """
+    Return the filtered images of paths in one contiguous uint8 block.
+
+    All the images must have the same shape (the ROI of the images of a
+    folder).
+
+    @param  stack   imageStack.ImageStack, paths are then frame indices
+    @return (block in shape (N, height, width), [cacheResult of each
+            image]), see measureImage
+    """
+    block = None
+    cacheResults = []
+    for i, path in enumerate(paths):
+        if stack is not None:
+            img = loadFrame(stack, path, roi, timer)
+        else:
+            counts = getCacheCounts(cache)
+            if cache is not None:
+                img = loadFilteredImage(path, roi, stopband2, cache, timer,
+                    scale)
+            else:
+                img = loadImage(path, roi, scale, timer)
+            cacheResults.append(getCacheResult(cache, counts))
+        if block is None:
+            block = np.empty((len(paths),) + img.shape[:2], np.uint8)
+        elif img.shape[:2] != block.shape[1:]:
+            raise ValueError("%s is %dx%d, the images of a block must have "
+                "the same shape" % (path, img.shape[1], img.shape[0]))
+        if stack is None and cache is not None:
+            # Already filtered (and stored) by the cache
+            block[i] = img
+        else:
+            filterImage(img, stopband2, timer, block[i])
+    return block, cacheResults or [None] * len(paths)
+
+def measureBlock(task):
+    """
+    Load, filter and measure a block of images at once.
+
+    @param  task    (paths, roi, stopband2, func, args, cache, timing,
+                    scale, stack), func is called as func(block, *args)
+                    and returns one value per image, see
+                    imageMetrics.measureStack
+    @return [(shape, value, cacheResult, times)] of the images, the times
+            of the block come with the first image
+    """
+    paths, roi, stopband2, func, args, cache, timing, scale, stack = task
+    timer = StageTimer() if timing else None
+    block, cacheResults = loadFilteredBlock(paths, roi, stopband2, cache,
+        timer, scale, stack)
+    if timer is not None:
+        t = timer.start()
+    values = func(block, *args)
+    if timer is not None:
+        timer.stop('metrics', t)
+    times = [timer.getTimes() if timer is not None else None] + \
+        [None] * (len(paths) - 1)
+    return zip([block.shape[1:]] * len(paths), values, cacheResults, times)
+
+def mapBlocks(paths, func, args=(), roi=None, stopband2=5, pool=None,
+        blockSize=16, cache=None, timing=False, scale=1, stack=None):
+    """
+    Yield (shape, value, cacheResult, times) of the images in file order,
+    measured blockSize images at a time, see measureBlock.
+
+    @param  pool    multiprocessing.Pool to spread the blocks over, or
+                    None to process them in this process
+    """
+    tasks = ((paths[i:i + blockSize], roi, stopband2, func, args, cache,
+        timing, scale, stack) for i in range(0, len(paths), blockSize))
+    if pool is None:
+        return chain.from_iterable(imap(measureBlock, tasks))
+    return chain.from_iterable(pool.imap(measureBlock, tasks))
@@ -0,0 +1,728 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015-2016, Xuyang Hu <xuyanghu@yahoo.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License version 2.1
+# as published by the Free Software Foundation
+
+"""
+batchProcesser processes all the images of a folder.
+
+It does not depend on Qt, so it can run on a headless machine (see
+batchCli). matplotlib is only imported when a result is shown.
+"""
+
+import cProfile
+import multiprocessing
+import os
+import pstats
+import re
+import time
+from itertools import izip
+
+import numpy as np
+
+import imageMetrics
+import imageStats
+import batchPipeline
+import imageStack
+from metricResults import MetricResults
+from prefetcher import Prefetcher
+from stageTimer import StageTimer
+
+# pylint: disable=C0103,R0904,W0102,W0201
+
+# (title, ylabel) of the metrics plotted against picture numbers
+metricTitles = {
+    'center': ('Center Points', 'Gray scale'),
+    'centerWithoutShift': ('Center value without shift',
+        'Center Point\'s Gray scale'),
+    'entropy': ('Entropy value', 'Entropy'),
+    'samples': ('Sample points', 'Gray scale'),
+    'average': ('Average value', 'Gray scale')}
+
+def fileExp(matchedSuffixes=['bmp', 'jpg', 'jpeg', 'png']):
+    """
+    Returns a compiled regexp matcher object for given list of suffixes.
+    """
+
+    # Create a regular expression string to match all the suffixes
+    matchedString = r'|'.join([r'^.*\.' + s + '$' for s in matchedSuffixes])
+
+    return re.compile(matchedString, re.IGNORECASE)
+
+class BatchCancelled(Exception):
+    """
+    Raised by BatchProcessing when cancel() is called during a run.
+    """
+    pass
+
+class BatchProcessing():
+    """
+    Process all the images in the given folder.
+
+    rootPath can also be a stack file (.npy, or raw frames described by
+    a json file, see imageStack). Its frames are memory mapped and
+    processed without decoding, they are always streamed, not cached
+    and decodeScale does not apply. listPaths then holds the frame
+    indices.
+
+    By default every filtered image is kept in processQueue. With
+    streaming=True nothing is kept: each get* call decodes and filters
+    the images again, one at a time, so memory use does not grow with
+    the number of images.
+
+    With workers > 1 the images are spread over a process pool of that
+    size (this implies streaming). Only the measured values come back
+    from the workers, in file order. Call close() to stop the pool.
+
+    stopband2 is the stopband^2 of the Butterworth blur applied to every
+    image before it is measured.
+
+    In streaming mode with blockSize > 1, the images are filtered into
+    (blockSize, height, width) blocks and the metrics are computed on a
+    whole block at once with vectorized numpy. All the images must then
+    have the same shape.
+
+    Only the ROI of the images is kept and filtered. With decodeScale
+    2, 4 or 8 the images are decoded at 1/decodeScale of their size
+    (JPEG is decoded at that size directly), the ROI is still given in
+    full size coordinates but the metrics are measured on the reduced
+    images.
+
+    In streaming mode, an imageCache.FilteredImageCache given as cache
+    keeps the filtered images on disk, so later runs on the same folder
+    skip decoding and filtering.
+
+    The metrics of all the get* calls are kept in results, a
+    metricResults.MetricResults with one numpy column per metric and
+    args (see getColumnName) and one row per image, see getResults.
+
+    progress(done, total) is called after each image of a run. cancel()
+    can be called from another thread, the run then stops after the
+    current image and raises BatchCancelled.
+
+    With timing=True the time of every stage (decode, ROI, filter build,
+    FFT, IFFT, metrics...) is accumulated, see getTimings. With
+    profile=True each run is also profiled with cProfile, see
+    getProfileStats; the worker processes are not profiled. Both
+    reports are printed at the end of each run.
+
+    With prefetch > 0 and a single process, up to prefetch images are
+    read and decoded ahead by prefetchWorkers threads while the current
+    one is filtered, see prefetcher. getPrefetchStats tells whether the
+    reading or the filtering was the bottleneck.
+    """
+
+    globalROI = None
+    imageShape = None
+
+    def __init__(self, rootPath='./', roi=None, streaming=False, workers=1,
+            cache=None, progress=None, stopband2=5, timing=False,
+            profile=False, decodeScale=1, blockSize=1, prefetch=0,
+            prefetchWorkers=2):
+        print "Batch path: " + rootPath
+        self.stack = None
+        if imageStack.isStackFile(rootPath):
+            self.stack = imageStack.ImageStack(rootPath)
+        elif not os.path.isdir(rootPath):
+            rootPath = repr(rootPath)[2:-1]
+            if not os.path.isdir(rootPath):
+                return
+        self.rootPath = rootPath
+        self.listPaths = []
+        self.listFileNames = []
+        self.fileStats = {}
+        self.scanFolder()
+        print "Files count: " + str(len(self.listFileNames))
+        print self.listFileNames
+        
+        self.processQueue = []
+        self.results = MetricResults()
+        self.workers = workers
+        self.streaming = streaming or workers > 1 or self.stack is not None
+        self.cache = cache if self.stack is None else None
+        self.progress = progress
+        self.stopband2 = stopband2
+        self.decodeScale = decodeScale
+        self.blockSize = blockSize
+        self.timer = StageTimer() if timing else None
+        self.profile = profile
+        self.profileStats = None
+        self.prefetcher = None
+        if prefetch > 0:
+            self.prefetcher = Prefetcher(prefetch, prefetchWorkers)
+        self.isCancelled = False
+        self._pool = None
+
+        if roi:
+            self.globalROI = roi
+
+        if not self.streaming:
+            self.loadImages()
+
+    def loadImages(self, paths=None):
+        """
+        Load the images of paths (all the images in the selected folder
+        by default) into processQueue, the images already loaded are
+        replaced.
+        """
+        # imageProcesser needs Qt, only the non streaming mode uses it
+        from imageProcesser import SingleImageProcess
+        if paths is None:
+            paths = self.listPaths
+        if self.prefetcher is None:
+            images = (batchPipeline.loadImage(path, self.globalROI,
+                self.decodeScale, self.timer) for path in paths)
+        else:
+            images = self.iterPrefetched(paths)
+        indices = self.getIndices()
+        for path, img in izip(paths, images):
+            im = SingleImageProcess(fileName=path, img=img)
+            # im.img = im.getGaussaianBlur()
+            im.img = batchPipeline.filterImage(img, self.stopband2,
+                self.timer)
+            index = indices[path]
+            if index < len(self.processQueue):
+                self.processQueue[index] = im
+            else:
+                # New images are appended to listPaths in order
+                self.processQueue.append(im)
+
+    def getIndices(self):
+        """
+        Return {path: index in listPaths}.
+        """
+        return dict((path, index)
+            for index, path in enumerate(self.listPaths))
+
+    def scanFolder(self, settleTime=0):
+        """
+        List the folder and find the images added or modified since the
+        last scan. New images are appended to listPaths in name order.
+
+        @param  settleTime      images modified less than settleTime seconds
+                                ago are left for the next scan since they
+                                may still be written
+        @return (newPaths, modifiedPaths)
+        """
+        newPaths, modifiedPaths, fileStats = self.findChanges(settleTime)
+        self.addChanges(newPaths, fileStats)
+        return newPaths, modifiedPaths
+
+    def findChanges(self, settleTime=0):
+        """
+        Like scanFolder, but nothing is changed until addChanges.
+
+        @return (newPaths, modifiedPaths, {path: new (mtime, size)})
+        """
+        if self.stack is not None:
+            # Frames can only be appended to a stack
+            return range(len(self.listPaths), self.stack.refresh()), [], {}
+
+        now = time.time()
+        matcher = fileExp()
+        newPaths = []
+        modifiedPaths = []
+        fileStats = {}
+        for fileName in sorted(os.listdir(self.rootPath)):
+            if not matcher.match(fileName):
+                continue
+            absPath = os.path.join(self.rootPath, fileName)
+            try:
+                stat = os.stat(absPath)
+            except OSError:
+                continue
+            if settleTime > 0 and now - stat.st_mtime < settleTime:
+                continue
+            fileStat = (stat.st_mtime, stat.st_size)
+            oldStat = self.fileStats.get(absPath)
+            if oldStat is None:
+                newPaths.append(absPath)
+            elif oldStat != fileStat:
+                modifiedPaths.append(absPath)
+            else:
+                continue
+            fileStats[absPath] = fileStat
+        return newPaths, modifiedPaths, fileStats
+
+    def addChanges(self, newPaths, fileStats):
+        """
+        Append newPaths to listPaths and record the new file stats.
+        """
+        self.listPaths.extend(newPaths)
+        self.listFileNames.extend(self.getFileName(path)
+            for path in newPaths)
+        self.fileStats.update(fileStats)
+
+    def removeChanges(self, newPaths, oldStats):
+        """
+        Undo addChanges, so the next scan finds the changes again.
+
+        @param  oldStats    {path: old (mtime, size)} of the modified images
+        """
+        count = len(self.listPaths) - len(newPaths)
+        del self.listPaths[count:]
+        del self.listFileNames[count:]
+        del self.processQueue[count:]
+        for path in newPaths:
+            self.fileStats.pop(path, None)
+        self.fileStats.update(oldStats)
+
+    def iterImages(self):
+        """
+        Yield the filtered images in file order.
+        """
+        if not self.streaming:
+            return (im.img for im in self.processQueue)
+        return self.iterPaths(self.listPaths)
+
+    def iterPaths(self, paths):
+        """
+        Yield the filtered images of paths (frame indices for a stack).
+        """
+        if not self.streaming:
+            indices = self.getIndices()
+            return (self.processQueue[indices[path]].img for path in paths)
+        if self.stack is not None:
+            return batchPipeline.iterFilteredFrames(self.stack, paths,
+                self.globalROI, self.stopband2, self.timer)
+        return batchPipeline.iterFilteredImages(paths, self.globalROI,
+            self.stopband2, self.cache, self.timer, self.decodeScale,
+            self.prefetcher)
+
+    def iterPrefetched(self, paths):
+        """
+        Yield the decoded ROI of paths, read ahead by the prefetcher.
+        """
+        roi = self.globalROI
+        scale = self.decodeScale
+        for img, seconds in self.prefetcher.imap(
+                lambda path: batchPipeline.loadImage(path, roi, scale),
+                paths):
+            if self.timer is not None:
+                self.timer.add('decode', seconds)
+            yield img
+
+    def getPool(self):
+        """
+        Return the process pool, it is started on first use.
+        """
+        if self._pool is None:
+            self._pool = multiprocessing.Pool(self.workers)
+        return self._pool
+
+    def close(self):
+        """
+        Stop the worker processes and the prefetch threads (if any).
+        """
+        if self.prefetcher is not None:
+            self.prefetcher.close()
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+
+    def cancel(self):
+        """
+        Stop the current run after the image being processed.
+        """
+        self.isCancelled = True
+
+    def mapImages(self, func, args=(), paths=None, blockSize=1,
+            results=None):
+        """
+        Return [func(img, *args) for each filtered image] in file order.
+
+        func must be a module level function when workers > 1 since it
+        is sent to the worker processes.
+
+        @param  paths       only process these images, defaults to all
+                            the images (streamed unless they are in
+                            processQueue)
+        @param  blockSize   when > 1, func(block, *args) is called on
+                            (N, height, width) blocks of blockSize images
+                            and returns N values, see
+                            batchPipeline.mapBlocks (streaming only)
+        @param  results     MetricResults the values ({metric name: value}
+                            dicts) are appended to, instead of a list
+        """
+        # A cancel() which came after the end of the previous run
+        self.isCancelled = False
+        if not self.profile:
+            values = self._mapImages(func, args, paths, blockSize, results)
+        else:
+            profiler = cProfile.Profile()
+            profiler.enable()
+            try:
+                values = self._mapImages(func, args, paths, blockSize,
+                    results)
+            finally:
+                profiler.disable()
+                if self.profileStats is None:
+                    self.profileStats = pstats.Stats(profiler)
+                else:
+                    self.profileStats.add(profiler)
+
+        if self.timer is not None:
+            print "Stage times of " + self.rootPath
+            print self.timer.report()
+            if self.prefetcher is not None:
+                print self.prefetcher.report()
+        if self.profileStats is not None:
+            self.profileStats.sort_stats('cumulative').print_stats(15)
+        return values
+
+    def _mapImages(self, func, args, paths, blockSize, results):
+        if paths is None:
+            paths = self.listPaths
+            images = self.iterImages()
+        else:
+            images = self.iterPaths(paths)
+        if blockSize > 1:
+            pool = self.getPool() if self.workers > 1 else None
+            measured = batchPipeline.mapBlocks(paths, func, args,
+                self.globalROI, self.stopband2, pool, blockSize, self.cache,
+                self.timer is not None, self.decodeScale, self.stack)
+        elif self.workers > 1:
+            # A few chunks per worker keep them balanced without
+            # paying IPC for every single image
+            chunkSize = max(1, len(paths) / (self.workers * 4))
+            if self.stack is not None:
+                measured = batchPipeline.mapFrames(self.stack, paths, func,
+                    args, self.globalROI, self.stopband2, self.getPool(),
+                    chunkSize, self.timer is not None)
+            else:
+                measured = batchPipeline.mapImages(paths, func, args,
+                    self.globalROI, self.stopband2, self.getPool(),
+                    chunkSize, self.cache, self.timer is not None,
+                    self.decodeScale)
+        else:
+            measured = measureImages(images, func, args, self.timer)
+        values = [] if results is None else results
+        total = len(paths)
+        for done, (path, (shape, value, cacheResult, times)) in enumerate(
+                izip(paths, measured), 1):
+            if self.isCancelled:
+                self.isCancelled = False
+                if self._pool is not None:
+                    self._pool.terminate()
+                    self._pool = None
+                raise BatchCancelled()
+            self.imageShape = shape
+            if results is None:
+                values.append(value)
+            else:
+                results.append(value, self.getFileName(path),
+                    self.getTimestamp(path))
+            if self.progress is not None:
+                self.progress(done, total)
+            if self.workers > 1 and cacheResult is not None and \
+                    self.cache is not None:
+                # Count the lookups and the entries written by the worker
+                # processes, the cap is enforced here
+                cacheHit, writtenBytes = cacheResult
+                if cacheHit:
+                    self.cache.hits += 1
+                else:
+                    self.cache.misses += 1
+                self.cache.addEntryBytes(writtenBytes)
+            if times is not None:
+                self.timer.merge(times)
+        return values
+
+    def getTimings(self):
+        """
+        Return the stage times of all the runs so far, or None when
+        timing is off, see stageTimer.StageTimer.getSummary.
+        """
+        if self.timer is None:
+            return None
+        return self.timer.getSummary()
+
+    def getProfileStats(self):
+        """
+        Return the pstats.Stats of the profiled runs, or None. Use its
+        dump_stats(path) to save them for other profiling tools.
+        """
+        return self.profileStats
+
+    def getPrefetchStats(self):
+        """
+        Return the stall and queue depth counters of the prefetcher, or
+        None when prefetching is off, see prefetcher.Prefetcher.getStats.
+        """
+        if self.prefetcher is None:
+            return None
+        return self.prefetcher.getStats()
+
+    def getCacheStats(self):
+        """
+        Return the hit/miss counts of the cache, see imageCache.
+        """
+        if self.cache is None:
+            return None
+        return self.cache.getStats()
+
+    def getResults(self):
+        """
+        Return the MetricResults of all the metrics measured so far, the
+        columns are named by getColumnName.
+        """
+        return self.results
+
+    def getFileName(self, path):
+        if self.stack is not None:
+            return self.stack.getFrameName(path)
+        return os.path.basename(path)
+
+    def getTimestamp(self, path):
+        """
+        Return the modification time of the image, NaN for a frame.
+        """
+        if self.stack is not None or path not in self.fileStats:
+            return np.nan
+        return self.fileStats[path][0]
+
+    def getMetrics(self, plan, showResult=False):
+        """
+        Compute all the metrics of plan in a single pass over the images.
+
+        Usage:  getMetrics({'col': (50,), 'entropy': (), 'average': ()})
+
+        @param  plan        {metric name: args}, see imageMetrics.measureAll
+        @return results     {metric name: values}, values has one number per
+                            image, but for 'col' and 'row' which have
+                            pointCount rows of one number per image and
+                            'samples' which is a (points x images) array
+        """
+        self.results.merge(self.measureResults(plan),
+            names=getColumnNames(plan))
+        results = self.getMetricValues(plan)
+
+        if showResult:
+            self.showMetrics(plan, results)
+        return results
+
+    def measureResults(self, plan, paths=None):
+        """
+        Return the MetricResults of plan for paths (all the images by
+        default), the images are measured by blocks when blockSize > 1.
+        """
+        results = MetricResults(len(self.listPaths if paths is None
+            else paths))
+        if self.blockSize > 1 and self.streaming:
+            self.mapImages(imageMetrics.measureStack, (plan,), paths,
+                self.blockSize, results)
+        else:
+            self.mapImages(imageMetrics.measureAll, (plan,), paths,
+                results=results)
+        return results
+
+    def getMetricValues(self, plan):
+        """
+        Return the metrics of plan in results as returned by getMetrics,
+        the arrays are copies so later runs do not change them.
+        """
+        values = {}
+        for name, args in plan.items():
+            column = getColumnName(name, args)
+            if column not in self.results:
+                values[name] = np.array([])
+            elif name in ('col', 'row', 'samples'):
+                values[name] = self.results[column].T.copy()
+            else:
+                values[name] = self.results[column].copy()
+        return values
+
+    def updateMetrics(self, plan, results, settleTime=1.0):
+        """
+        Measure the images added or modified since the last scan and
+        merge them into results, so only the changed images are
+        processed. Used to follow a folder that is being written. When
+        the update fails or is cancelled, nothing is merged and the
+        changes are left for the next update.
+
+        When not streaming, the changed images are loaded into
+        processQueue first.
+
+        @param  results     results of getMetrics with the same plan,
+                            updated in place (the arrays are replaced)
+        @param  settleTime  see scanFolder
+        @return number of images measured
+        """
+        newPaths, modifiedPaths, fileStats = self.findChanges(settleTime)
+        paths = modifiedPaths + newPaths
+        if not paths:
+            return 0
+        oldStats = dict((path, self.fileStats[path]) for path in modifiedPaths)
+        # The timestamps of the measured rows come from the new stats
+        self.addChanges(newPaths, fileStats)
+        try:
+            if not self.streaming:
+                self.loadImages(paths)
+            update = self.measureResults(plan, paths)
+        except Exception:
+            # Cancelled or an image could not be read: the changes are
+            # found again by the next update
+            self.removeChanges(newPaths, oldStats)
+            raise
+        indices = self.getIndices()
+        indices = [indices[path] for path in paths]
+        self.results.merge(update, indices, getColumnNames(plan))
+        results.update(self.getMetricValues(plan))
+        return len(paths)
+
+    def getStatistics(self, percentiles=(), showResult=False):
+        """
+        Return the gray level statistics of all images in one pass.
+
+        @return     {'mean', 'std', 'min', 'max', 'entropy'[, 'percentiles']}
+                    arrays with one value (row) per image, see imageStats
+        """
+        histograms = self.getMetrics({'histogram': ()})['histogram']
+        stats = imageStats.getStatistics(histograms.reshape(-1, 256),
+            percentiles)
+        if showResult:
+            plotGraphs([stats['mean'], stats['std'], stats['entropy']])
+        return stats
+
+    def showMetrics(self, plan, results, block=True):
+        """
+        Plot the metrics of plan returned by getMetrics in one figure,
+        see resultPlotter. Histograms are summarized by getStatistics
+        instead.
+        """
+        import matplotlib.pyplot as plt
+        from resultPlotter import LiveMetricsFigure
+        names = [name for name in imageMetrics.METRICS if name in plan and
+            name not in ('col', 'row', 'histogram')]
+        profiles = {}
+        for name in ('col', 'row'):
+            if name not in plan:
+                continue
+            loc, pointCount = getSampleArgs(*plan[name])
+            if name == 'col':
+                size = self.imageShape[1]
+                title = 'Points in a col when x==' + str(loc)
+            else:
+                size = self.imageShape[0]
+                title = 'Points in a row when y==' + str(loc)
+            profiles[name] = (title,
+                'Y position' if name == 'col' else 'X position',
+                np.arange(pointCount) * (size / pointCount))
+        figure = LiveMetricsFigure(names, metricTitles, profiles, live=False)
+        figure.update(results)
+        plt.show(block=block)
+        return figure
+
+    def showMetric(self, name, values, *args):
+        """
+        Plot the values of a metric returned by getMetrics.
+        """
+        return self.showMetrics({name: args}, {name: values})
+
+    def getCenterPoints(self, showResult=False):
+        """
+        Calculate center points of all the iamges, they are also kept
+        in results.
+        """
+        print "============== Getting Center Point =========="
+        return self.getMetrics({'center': ()}, showResult)['center']
+
+    def getPointsInACol(self, LocX=0, pointCount=10, showResult=False):
+        """
+        Return value of pointCount=10 points when x = LocX
+        Returns pointCount=10 rows, each row has one number in float
+        for each image.
+        """
+        print "========================= getPointsInACol =========================="
+        return self.getMetrics({'col': (LocX, pointCount)},
+            showResult)['col']
+
+    def getPointsInARow(self, LocY=0, pointCount=10, showResult=False):
+        """
+        Return value of pointCount=10 points when y = LocY
+        Returns pointCount=10 rows, each row has one number in float
+        for each image.
+        """
+        print "========================= getPointsInARow =========================="
+        return self.getMetrics({'row': (LocY, pointCount)},
+            showResult)['row']
+
+    def getSamples(self, grid, showResult=False):
+        """
+        Return the average values of the rects of grid in all images.
+
+        @param  grid    imageSampling.SampleGrid, e.g.
+                        SampleGrid.fromEvenGrid(shape, 100, 100)
+        @return         array in shape (len(grid), number of images)
+        """
+        return self.getMetrics({'samples': (grid,)}, showResult)['samples']
+
+    def getAverageValues(self, showResult=False):
+        """
+        Return average value of all images.
+        """
+        return self.getMetrics({'average': ()}, showResult)['average']
+
+    def getCenterPointsWithoutShift(self, LocX=0, pointCount=10, showResult=False):
+        """
+        Return gray scale of center points removing average value
+        as global shift.
+        """
+        return self.getMetrics({'centerWithoutShift': ()},
+            showResult)['centerWithoutShift']
+
+    def getShannonEntropies(self, showResult=False):
+        """
+        Return average value of all images.
+        """
+        return self.getMetrics({'entropy': ()}, showResult)['entropy']
+
+def measureImages(images, func, args=(), timer=None):
+    """
+    Yield (shape, func(img, *args), None, None) for each image, like
+    batchPipeline.mapImages does for the images processed in this
+    process, which already count their cache hits and stage times.
+    """
+    for img in images:
+        if timer is not None:
+            t = timer.start()
+        value = func(img, *args)
+        if timer is not None:
+            timer.stop('metrics', t)
+        yield img.shape, value, None, None
+
+def getSampleArgs(loc=0, pointCount=10):
+    """
+    Return the args of a 'col' or 'row' metric with the defaults filled.
+    """
+    return loc, pointCount
+
+def getColumnName(name, args):
+    """
+    Return the name of the results column of a metric measured with
+    args, e.g. 'col-0-10', so each args of a metric has its own column.
+    """
+    if name in ('col', 'row'):
+        args = getSampleArgs(*args)
+    elif name == 'samples':
+        args = (args[0].getKey(),)
+    return '-'.join([name] + [str(arg) for arg in args])
+
+def getColumnNames(plan):
+    """
+    Return {metric name: column name} of the metrics of plan.
+    """
+    return dict((name, getColumnName(name, args))
+        for name, args in plan.items())
+
+def plotGraphs(dataArr):
+    """
+    Plot each series of dataArr in a subplot of one figure.
+    """
+    from resultPlotter import showSeries
+    showSeries(dataArr)
@@ -0,0 +1,309 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015-2016, Xuyang Hu <xuyanghu@yahoo.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License version 2.1
+# as published by the Free Software Foundation
+
+"""
+benchmark times the image processing stages on synthetic images.
+
+It runs headless (no Qt, no window): folders of generated images are
+written to a work directory, every stage is timed on them and the
+throughput, the peak memory and the per stage times are reported.
+
+Usage:
+    python benchmark.py --sizes 256,1024 --count 20 --save base.json
+    (change the code)
+    python benchmark.py --sizes 256,1024 --count 20 --compare base.json
+
+With --compare, the stages slower than the base run by more than
+--threshold are listed and the exit status is 1.
+
+Each image size runs in its own process, so the peak memory of a size
+does not include the previous ones. The stages are the ones of the
+single image view (filter build, DFT, Butterworth blur, entropy, points
+in a col) and of "Process All" (decoding and filtering a folder, the
+metrics of a folder).
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import shutil
+import sys
+import tempfile
+import time
+from timeit import default_timer
+
+import cv2
+import numpy as np
+
+import batchPipeline
+import batchProcesser
+import imageMetrics
+from frequencyFilter import defaultFilterBank, defaultEngine, getShiftedDFT
+
+# pylint: disable=C0103,R0904,W0102,W0201
+
+# The metrics of "Process All" in mainUI
+batchPlan = {
+    'col': (50,),
+    'row': (50,),
+    'centerWithoutShift': (),
+    'entropy': (),
+    'average': ()}
+
+def makeImage(shape, seed=0):
+    """
+    Return a synthetic gray image: smooth blobs, a gradient and some
+    noise, so that it compresses and filters like a real picture.
+    """
+    rng = np.random.RandomState(seed)
+    h, w = shape
+    small = rng.uniform(0, 255, (max(h / 32, 2), max(w / 32, 2)))
+    img = cv2.resize(small, (w, h), interpolation=cv2.INTER_CUBIC)
+    img += np.linspace(-30, 30, w)[np.newaxis, :]
+    img += rng.normal(0, 8, shape)
+    return np.uint8(np.clip(img, 0, 255))
+
+def makeFolder(folder, count, shape, fileFormat='png'):
+    """
+    Write count synthetic images to folder, unless they already exist.
+
+    @return     list of the image paths
+    """
+    if not os.path.isdir(folder):
+        os.makedirs(folder)
+    paths = []
+    for i in range(count):
+        path = os.path.join(folder, 'img%05d.%s' % (i, fileFormat))
+        if not os.path.isfile(path):
+            cv2.imwrite(path, makeImage(shape, seed=i))
+        paths.append(path)
+    return paths
+
+def getPeakMemory():
+    """
+    Return the peak resident memory of this process in MB.
+    """
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+def timeStage(func, repeat=3):
+    """
+    Run func repeat times (after a warm up run).
+
+    @return     list of the times in seconds
+    """
+    func()
+    times = []
+    for i in range(repeat):
+        start = default_timer()
+        func()
+        times.append(default_timer() - start)
+    return times
+
+def summarize(times, items, pixels):
+    """
+    Return the result of a stage.
+
+    @param  items   number of images processed per run
+    @param  pixels  number of pixels processed per run
+    """
+    best = min(times)
+    return {
+        'best': best,
+        'median': float(np.median(times)),
+        'imagesPerSecond': items / best if best > 0 else 0.0,
+        'megapixelsPerSecond': pixels / best / 1e6 if best > 0 else 0.0}
+
+def runBatchMetrics(folder):
+    # BatchProcessing lists the folder on stdout
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, 'w')
+    try:
+        batch = batchProcesser.BatchProcessing(rootPath=folder,
+            streaming=True)
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+    return batch.getMetrics(batchPlan)
+
+def benchmarkSize(shape, count, repeat, workDir):
+    """
+    Time all the stages on images of shape.
+
+    @return     {stage name: result}, see summarize
+    """
+    folder = os.path.join(workDir, '%dx%d_%d' % (shape[1], shape[0], count))
+    paths = makeFolder(folder, count, shape)
+    img = batchPipeline.loadImage(paths[0])
+    blurred = defaultEngine.getButterworthBlur(img)
+    pixels = img.size
+
+    def buildFilter():
+        defaultFilterBank.clear()
+        defaultFilterBank.getFilter(img.shape)
+
+    stages = [
+        ('decode', lambda: batchPipeline.loadImage(paths[0]), 1),
+        ('filterBuild', buildFilter, 1),
+        ('dft', lambda: getShiftedDFT(img), 1),
+        ('butterworthBlur', lambda: defaultEngine.getButterworthBlur(img), 1),
+        ('shannonEntropy', lambda: imageMetrics.getShannonEntropy(blurred),
+            1),
+        ('pointsInACol', lambda: imageMetrics.getPointsInACol(blurred, 50),
+            1),
+        ('batchLoad', lambda: list(batchPipeline.iterFilteredImages(paths)),
+            count),
+        ('batchMetrics', lambda: runBatchMetrics(folder), count)]
+
+    baseMemory = getPeakMemory()
+    results = {}
+    for name, func, items in stages:
+        times = timeStage(func, repeat)
+        results[name] = summarize(times, items, pixels * items)
+    peakMemory = getPeakMemory()
+    results['memory'] = {'peakMB': peakMemory,
+        'deltaMB': peakMemory - baseMemory}
+    return results
+
+def runSizeInProcess(queue, shape, count, repeat, workDir):
+    try:
+        queue.put(benchmarkSize(shape, count, repeat, workDir))
+    except Exception as e: # pylint: disable=W0703
+        queue.put(e)
+
+def runBenchmark(sizes, count=10, repeat=3, workDir=None):
+    """
+    Run the benchmark for every (height, width) of sizes.
+
+    @return     dict of the run, see saveRun
+    """
+    isTempDir = workDir is None
+    if isTempDir:
+        workDir = tempfile.mkdtemp(prefix='imagePickerBench')
+    run = {
+        'info': {
+            'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'python': platform.python_version(),
+            'opencv': cv2.__version__,
+            'numpy': np.__version__,
+            'machine': platform.platform(),
+            'count': count,
+            'repeat': repeat},
+        'results': {}}
+    try:
+        for shape in sizes:
+            queue = multiprocessing.Queue()
+            process = multiprocessing.Process(target=runSizeInProcess,
+                args=(queue, shape, count, repeat, workDir))
+            process.start()
+            result = queue.get()
+            process.join()
+            if isinstance(result, Exception):
+                raise result
+            run['results']['%dx%d' % (shape[1], shape[0])] = result
+    finally:
+        if isTempDir:
+            shutil.rmtree(workDir, ignore_errors=True)
+    return run
+
+def printRun(run):
+    for size in sorted(run['results'],
+            key=lambda s: np.prod(map(int, s.split('x')))):
+        result = run['results'][size]
+        print "%s, %d images, peak memory %.1f MB" % (size,
+            run['info']['count'], result['memory']['peakMB'])
+        print "    %-16s %10s %10s %10s %10s" % ('stage', 'best ms',
+            'median ms', 'images/s', 'MPix/s')
+        for name in sorted(result):
+            if name == 'memory':
+                continue
+            stage = result[name]
+            print "    %-16s %10.2f %10.2f %10.1f %10.1f" % (name,
+                stage['best'] * 1000, stage['median'] * 1000,
+                stage['imagesPerSecond'], stage['megapixelsPerSecond'])
+
+def compareRuns(base, run, threshold=0.1):
+    """
+    Print the time ratio of the stages run in both runs.
+
+    @return     list of the (size, stage, ratio) slower than threshold
+    """
+    regressions = []
+    print "Compared to the run of " + base['info']['time']
+    for size in sorted(run['results']):
+        if size not in base['results']:
+            continue
+        for name in sorted(run['results'][size]):
+            if name == 'memory' or name not in base['results'][size]:
+                continue
+            old = base['results'][size][name]['best']
+            new = run['results'][size][name]['best']
+            ratio = new / old if old > 0 else 1.0
+            flag = ''
+            if ratio > 1 + threshold:
+                flag = ' REGRESSION'
+                regressions.append((size, name, ratio))
+            print "    %-10s %-16s %6.2fx%s" % (size, name, ratio, flag)
+    return regressions
+
+def saveRun(run, path):
+    with open(path, 'w') as f:
+        json.dump(run, f, indent=1, sort_keys=True)
+
+def loadRun(path):
+    with open(path) as f:
+        return json.load(f)
+
+def parseSizes(text):
+    """
+    Parse '256,640x480' into [(256, 256), (480, 640)], sizes are given
+    as width x height.
+    """
+    sizes = []
+    for size in text.split(','):
+        w, sep, h = size.partition('x')
+        try:
+            sizes.append((int(h or w), int(w)))
+        except ValueError:
+            raise argparse.ArgumentTypeError("not a size: " + size)
+    return sizes
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Time the image processing stages on synthetic images.")
+    parser.add_argument('--sizes', type=parseSizes,
+        default=parseSizes('256,512,1024'),
+        help="image sizes, N or WxH (default: 256,512,1024)")
+    parser.add_argument('--count', type=int, default=10,
+        help="number of images in a folder (default: 10)")
+    parser.add_argument('--repeat', type=int, default=3,
+        help="timed runs of each stage (default: 3)")
+    parser.add_argument('--workdir', metavar='DIR',
+        help="keep the generated images in this directory")
+    parser.add_argument('--save', metavar='FILE',
+        help="save the results as json")
+    parser.add_argument('--compare', metavar='FILE',
+        help="compare to the results saved by a previous run")
+    parser.add_argument('--threshold', type=float, default=0.1,
+        help="slowdown reported as a regression (default: 0.1 = 10%%)")
+    args = parser.parse_args(argv)
+
+    run = runBenchmark(args.sizes, args.count, args.repeat, args.workdir)
+    printRun(run)
+    if args.save:
+        saveRun(run, args.save)
+    if args.compare:
+        if compareRuns(loadRun(args.compare), run, args.threshold):
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
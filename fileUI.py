@@ -16,6 +16,16 @@ import re
 import sys
 import os
 from PySide import QtGui, QtCore
+from thumbnailCache import ThumbnailCache
+
+try:
+    from os import scandir
+except ImportError:
+    try:
+        # Backport for Python 2, optional
+        from scandir import scandir
+    except ImportError:
+        scandir = None
 
 testPath = './lena.jpeg'
 
@@ -29,6 +39,160 @@ def fileExp(matchedSuffixes=['bmp', 'jpg', 'jpeg', 'png']):
 
     return re.compile(matchedString, re.IGNORECASE)
 
+class DirectoryScanner(QtCore.QThread):
+    """
+    Lists the image files of a folder in chunks, in a background thread.
+    """
+
+    # Emits a list of file names, and the generation they belong to
+    chunkLoaded = QtCore.Signal(list, int)
+
+    def __init__(self, folder, generation, chunkSize=2000, parent=None):
+        super(DirectoryScanner, self).__init__(parent)
+        self.folder = folder
+        self.generation = generation
+        self.chunkSize = chunkSize
+        self.isCancelled = False
+
+    def run(self):
+        matcher = fileExp()
+        if scandir is not None:
+            names = (entry.name for entry in scandir(self.folder))
+        else:
+            names = iter(os.listdir(self.folder))
+        chunk = []
+        for fileName in names:
+            if self.isCancelled:
+                return
+            if matcher.match(fileName):
+                chunk.append(fileName)
+                if len(chunk) >= self.chunkSize:
+                    self.chunkLoaded.emit(chunk, self.generation)
+                    chunk = []
+        if chunk:
+            self.chunkLoaded.emit(chunk, self.generation)
+
+class DirectoryListModel(QtCore.QAbstractListModel):
+    """
+    List model of the image files of a folder, populated lazily.
+
+    The folder is scanned by a DirectoryScanner, and the names it finds
+    are only inserted as rows when the view asks for them through
+    canFetchMore/fetchMore: the first rowCount() names of the list are
+    the rows. Only the file names are kept; thumbnails are requested
+    from the ThumbnailCache for the rows that are shown, and only these
+    requests remember their row.
+    """
+
+    def __init__(self, thumbnails=None, fetchSize=500, parent=None):
+        super(DirectoryListModel, self).__init__(parent)
+        self.thumbnails = thumbnails
+        self.fetchSize = fetchSize
+        self.rootPath = None
+        # All the names scanned so far, the first fetchedCount are rows
+        self.names = []
+        self.fetchedCount = 0
+        self.generation = 0
+        # {path: row} of the thumbnails requested and not ready yet
+        self._pendingRows = {}
+        self._scanner = None
+        # Cancelled scanners, kept until their thread has returned since
+        # a QThread destroyed while running aborts the program
+        self._stoppingScanners = []
+        if thumbnails is not None:
+            thumbnails.thumbnailReady.connect(self.onThumbnailReady)
+            thumbnails.thumbnailFailed.connect(self.onThumbnailFailed)
+
+    def setRootPath(self, folder):
+        """
+        Clears the model and starts scanning folder.
+        """
+        if self._scanner is not None:
+            self.stopScanner(self._scanner)
+        self.beginResetModel()
+        self.generation += 1
+        self.rootPath = folder
+        self.names = []
+        self.fetchedCount = 0
+        self._pendingRows = {}
+        self.endResetModel()
+
+        self._scanner = DirectoryScanner(folder, self.generation, parent=self)
+        self._scanner.chunkLoaded.connect(self.onChunkLoaded)
+        self._scanner.start()
+
+    def stopScanner(self, scanner):
+        """
+        Cancel scanner and keep it until its finished signal.
+        """
+        scanner.isCancelled = True
+        self._stoppingScanners.append(scanner)
+        scanner.finished.connect(lambda: self.releaseScanner(scanner))
+        if scanner.isFinished():
+            self.releaseScanner(scanner)
+
+    def releaseScanner(self, scanner):
+        if scanner in self._stoppingScanners:
+            self._stoppingScanners.remove(scanner)
+
+    def getPath(self, row):
+        return os.path.join(self.rootPath, self.names[row])
+
+    @QtCore.Slot(list, int)
+    def onChunkLoaded(self, chunk, generation):
+        if generation != self.generation:
+            return
+        self.names.extend(chunk)
+        # The view only asks for more rows when it is scrolled, so fill
+        # the first screen ourselves
+        if self.fetchedCount < self.fetchSize:
+            self.fetchMore(QtCore.QModelIndex())
+
+    @QtCore.Slot(str)
+    def onThumbnailReady(self, path):
+        row = self._pendingRows.pop(path, None)
+        if row is not None and row < self.fetchedCount and \
+                self.getPath(row) == path:
+            index = self.index(row)
+            self.dataChanged.emit(index, index)
+
+    @QtCore.Slot(str)
+    def onThumbnailFailed(self, path):
+        self._pendingRows.pop(path, None)
+
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        if parent.isValid():
+            return 0
+        return self.fetchedCount
+
+    def canFetchMore(self, parent):
+        return not parent.isValid() and self.fetchedCount < len(self.names)
+
+    def fetchMore(self, parent):
+        if parent.isValid():
+            return
+        first = self.fetchedCount
+        last = min(first + self.fetchSize, len(self.names)) - 1
+        if last < first:
+            return
+        self.beginInsertRows(QtCore.QModelIndex(), first, last)
+        self.fetchedCount = last + 1
+        self.endInsertRows()
+
+    def data(self, index, role=QtCore.Qt.DisplayRole):
+        if not index.isValid() or index.row() >= self.fetchedCount:
+            return None
+        if role == QtCore.Qt.DisplayRole:
+            return self.names[index.row()]
+        if role == QtCore.Qt.DecorationRole and self.thumbnails is not None:
+            path = self.getPath(index.row())
+            icon = self.thumbnails.getIcon(path)
+            if icon is None:
+                self._pendingRows[path] = index.row()
+                self.thumbnails.request(path)
+            return icon
+        return None
+
 class FilePicker(QtGui.QWidget):
     """
     Widget for picking (image) files from a directory.
@@ -40,7 +204,9 @@ class FilePicker(QtGui.QWidget):
     def __init__(self, parent=None):
         super(FilePicker, self).__init__(parent)
 
-        self.listModel = QtGui.QStandardItemModel()
+        # Thumbnails are loaded in background and shown when ready
+        self.thumbnails = ThumbnailCache(parent=self)
+        self.listModel = DirectoryListModel(self.thumbnails)
 
         self.listView = QtGui.QListView()
         self.listView.setUniformItemSizes(True)
@@ -52,6 +218,7 @@ class FilePicker(QtGui.QWidget):
 
         # Transforming slot-signal combo for emitting file names as strings
         self.listView.activated.connect(self.fileSelected)
+        self.listView.setIconSize(QtCore.QSize(64, 64))
 
         self.setLayout(QtGui.QHBoxLayout())
         self.layout().addWidget(self.listView)
@@ -68,13 +235,9 @@ class FilePicker(QtGui.QWidget):
             return
 
         self.rootPath = folder
-        self.listModel.clear()
-
-        for fileName in os.listdir(folder):
-            if fileExp().match(fileName):
-                absPath = os.path.join(self.rootPath, fileName)
-                item = QtGui.QStandardItem(fileName)
-                self.listModel.appendRow(item)
+        self.thumbnails.reset()
+        # Files are listed in background and shown as they come
+        self.listModel.setRootPath(folder)
 
     @QtCore.Slot(QtCore.QModelIndex)
     def fileSelected(self, modelIndex):
@@ -84,8 +247,7 @@ class FilePicker(QtGui.QWidget):
         Emits filePicked with absolute file path after receiving fileSelected.
         """
 
-        fullName = os.path.abspath(os.path.join(self.rootPath,
-            self.listModel.itemFromIndex(modelIndex).text()))
+        fullName = os.path.abspath(self.listModel.getPath(modelIndex.row()))
 
         if fileExp().match(fullName):
             self.fullName = fullName
@@ -101,9 +263,14 @@ class FilePicker(QtGui.QWidget):
             index = self.listView.indexAt(event.pos())
 
             if index.isValid():
-                item = self.listModel.itemFromIndex(index)
-                path = os.path.join(self.rootPath, item.text())
-                text = '%s <br /> <img width="300" src="%s" />' % (path, path)
+                path = self.listModel.getPath(index.row())
+                # Never let Qt load the full image for a tooltip
+                storedPath = self.thumbnails.getStoredPath(path)
+                if storedPath and os.path.isfile(storedPath):
+                    text = '%s <br /> <img src="%s" />' % (path, storedPath)
+                else:
+                    text = path
+                    self.thumbnails.request(path)
                 QtGui.QToolTip.showText(event.globalPos(), text)
             else:
                 QtGui.QToolTip.hideText()
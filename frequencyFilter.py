@@ -0,0 +1,360 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015-2016, Xuyang Hu <xuyanghu@yahoo.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License version 2.1
+# as published by the Free Software Foundation
+
+"""
+frequencyFilter contains the frequency domain helpers of imageProcesser.
+
+It does not depend on Qt, so it can be used by batch jobs directly.
+"""
+
+import collections
+import math
+import threading
+from multiprocessing.pool import ThreadPool
+
+import cv2
+import numpy as np
+
+# pylint: disable=C0103,R0904,W0102,W0201
+
+def butterworthGain(r2, stopband2=5, order=3):
+    """
+    Return the Butterworth gain for squared distances to the DC term.
+
+    Note:   r2 is modified in place.
+    """
+    r2[r2 == 0] = 1.0
+    return np.float32(1.0 / (1.0 + (r2 / stopband2) ** order))
+
+def buildButterworthFilter(shape, stopband2=5, order=3):
+    """
+    Build a Butterworth low-pass mask for the fftshift-ed spectrum.
+
+    @param  shape       (height, width) of the spectrum
+    @param  stopband2   stopband^2
+    @return mask        float32 array in shape (height, width)
+    """
+    h, w = shape[0], shape[1]
+    rows = np.arange(h, dtype=np.float64) - h // 2
+    cols = np.arange(w, dtype=np.float64) - w // 2
+    r2 = rows[:, np.newaxis] ** 2 + cols[np.newaxis, :] ** 2
+    return butterworthGain(r2, stopband2, order)
+
+def buildCCSButterworthFilter(shape, stopband2=5, order=3, srcShape=None):
+    """
+    Build a Butterworth mask laid out like the packed (CCS) spectrum that
+    cv2.dft returns for a real single channel image.
+
+    The mask is not shifted, so it can be multiplied with the spectrum
+    directly. Both the real and the imaginary slot of a frequency get
+    the same gain.
+
+    @param  shape       (height, width) of the (padded) spectrum
+    @param  srcShape    (height, width) of the image before padding,
+                        frequencies are scaled to it so that stopband2
+                        keeps its meaning. Defaults to shape.
+    @return mask        float32 array in shape (height, width)
+    """
+    h, w = shape[0], shape[1]
+    if srcShape is None:
+        srcShape = shape
+    rowScale = float(srcShape[0]) / h
+    colScale = float(srcShape[1]) / w
+
+    rowIdx = np.arange(h)
+    # Full complex columns: index i is frequency i or i - h
+    rowFreq = np.minimum(rowIdx, h - rowIdx) * rowScale
+    # Packed columns (DC and, for even widths, Nyquist): Re/Im pairs
+    packedRowFreq = ((rowIdx + 1) // 2) * rowScale
+    colFreq = ((np.arange(w) + 1) // 2) * colScale
+
+    r2 = rowFreq[:, np.newaxis] ** 2 + colFreq[np.newaxis, :] ** 2
+    r2[:, 0] = packedRowFreq ** 2
+    if w % 2 == 0:
+        r2[:, -1] = packedRowFreq ** 2 + colFreq[-1] ** 2
+    return butterworthGain(r2, stopband2, order)
+
+def getBandLimit(stopband2=5, order=3, tolerance=1e-4):
+    """
+    Return the smallest K such that the Butterworth gain is below
+    tolerance for all the frequencies with |ky| > K or |kx| > K.
+    """
+    r2 = stopband2 * (1.0 / tolerance - 1) ** (1.0 / order)
+    return int(math.ceil(math.sqrt(r2)))
+
+def getShiftedDFT(img):
+    """
+    Return the scaled complex DFT of img (two float32 channels) with the
+    zero frequency in the center, the spectrum SingleImageProcess shows.
+    """
+    dft = cv2.dft(np.float32(img),
+        flags=cv2.DFT_COMPLEX_OUTPUT|cv2.DFT_SCALE)
+    return np.fft.fftshift(dft)
+
+def getTiles(shape, tileSize=1024):
+    """
+    Return the (y0, y1, x0, x1) blocks covering an image of shape.
+    """
+    return [(y, min(y + tileSize, shape[0]), x, min(x + tileSize, shape[1]))
+        for y in range(0, shape[0], tileSize)
+        for x in range(0, shape[1], tileSize)]
+
+class ButterworthFilterBank(object):
+    """
+    A bounded LRU cache of Butterworth masks.
+
+    All the images of a folder share the same shape and stopband, so
+    the mask is built once and reused. Returned masks are shared between
+    callers and therefore read-only.
+    """
+
+    def __init__(self, maxSize=8):
+        self.maxSize = maxSize
+        self.hits = 0
+        self.misses = 0
+        self._masks = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def getFilter(self, shape, stopband2=5, order=3, layout='shifted',
+            srcShape=None):
+        """
+        Return the (cached) mask for the given shape and parameters.
+
+        @param  layout      'shifted' for the fftshift-ed complex spectrum,
+                            'ccs' for the packed real spectrum
+        @param  srcShape    see buildCCSButterworthFilter
+        """
+        shape = tuple(shape[:2])
+        if srcShape is not None:
+            srcShape = tuple(srcShape[:2])
+        key = (shape, stopband2, order, layout, srcShape)
+        with self._lock:
+            mask = self._masks.pop(key, None)
+            if mask is not None:
+                self.hits += 1
+                self._masks[key] = mask
+                return mask
+            self.misses += 1
+
+        if layout == 'ccs':
+            mask = buildCCSButterworthFilter(shape, stopband2, order,
+                srcShape)
+        elif layout == 'shifted':
+            mask = buildButterworthFilter(shape, stopband2, order)
+        else:
+            raise ValueError("Unknown filter layout: " + str(layout))
+        mask.flags.writeable = False
+
+        with self._lock:
+            self._masks[key] = mask
+            while len(self._masks) > self.maxSize:
+                self._masks.popitem(last=False)
+        return mask
+
+    def clear(self):
+        """
+        Drop all the cached masks.
+        """
+        with self._lock:
+            self._masks.clear()
+
+class FrequencyEngine(object):
+    """
+    Apply frequency domain filters through real-input FFTs.
+
+    cv2.dft of a real image gives the packed (CCS) half spectrum in a
+    single float32 plane, so the filter is applied without complex
+    arrays or fftshift copies. The float32 scratch planes are kept per
+    FFT size and per thread, so a folder of same-sized images does not
+    allocate new buffers for each image.
+
+    With padToOptimal=True images are padded to cv2.getOptimalDFTSize
+    (reflected borders), which is faster for sizes with large prime
+    factors.
+
+    Images of more than maxWholePixels pixels are filtered by tiles
+    instead, see getTiledButterworthBlur, so the memory used does not
+    grow with the image.
+
+    Note:   the stopband is a few cycles per image, so the padding
+            changes the whole blurred image, not only its borders: on a
+            490x490 image 10-28% of the pixels differ by more than one
+            gray level (up to 44). It is off by default so the results
+            match the unpadded filter.
+    """
+
+    def __init__(self, filterBank=None, padToOptimal=False,
+            maxWholePixels=1 << 26, tileSize=1024, tileWorkers=1,
+            tolerance=1e-4):
+        if filterBank is None:
+            filterBank = defaultFilterBank
+        self.filterBank = filterBank
+        self.padToOptimal = padToOptimal
+        self.maxWholePixels = maxWholePixels
+        self.tileSize = tileSize
+        self.tileWorkers = tileWorkers
+        self.tolerance = tolerance
+        self._local = threading.local()
+
+    def getPaddedShape(self, shape):
+        """
+        Return the size the FFT runs on for an image of given shape.
+        """
+        if not self.padToOptimal:
+            return tuple(shape[:2])
+        return (cv2.getOptimalDFTSize(shape[0]),
+            cv2.getOptimalDFTSize(shape[1]))
+
+    def _getScratch(self, shape):
+        """
+        Return the (plane, spectrum) float32 buffers of given shape.
+        """
+        buffers = getattr(self._local, 'buffers', None)
+        if buffers is None or buffers[0].shape != shape:
+            buffers = (np.empty(shape, np.float32),
+                np.empty(shape, np.float32))
+            self._local.buffers = buffers
+        return buffers
+
+    def getButterworthBlur(self, img, stopband2=5, order=3, dst=None,
+            timer=None):
+        """
+        Apply Butterworth low-pass filter to a single channel image.
+
+        @param  dst         uint8 array in the shape of img to write into,
+                            or None for a new one
+        @param  timer       stageTimer.StageTimer to time the steps in,
+                            or None
+        @return dstimg      uint8 image in the shape of img
+        """
+        h, w = img.shape[0], img.shape[1]
+        if self.maxWholePixels is not None and h * w > self.maxWholePixels:
+            return self.getTiledButterworthBlur(img, stopband2, order, dst,
+                timer)
+        return self._getWholeButterworthBlur(img, stopband2, order, dst,
+            timer)
+
+    def _getWholeButterworthBlur(self, img, stopband2, order, dst, timer):
+        if timer is not None:
+            t = timer.start()
+        h, w = img.shape[0], img.shape[1]
+        padShape = self.getPaddedShape(img.shape)
+        plane, spectrum = self._getScratch(padShape)
+        if padShape == (h, w):
+            plane[...] = img
+        else:
+            plane[...] = cv2.copyMakeBorder(img, 0, padShape[0] - h,
+                0, padShape[1] - w, cv2.BORDER_REFLECT)
+        if timer is not None:
+            t = timer.stop('pad', t)
+
+        bwfilter = self.filterBank.getFilter(padShape, stopband2, order,
+            layout='ccs', srcShape=(h, w))
+        if timer is not None:
+            t = timer.stop('filterBuild', t)
+        cv2.dft(plane, spectrum, cv2.DFT_SCALE)
+        if timer is not None:
+            t = timer.stop('fft', t)
+        cv2.multiply(spectrum, bwfilter, spectrum)
+        if timer is not None:
+            t = timer.stop('multiply', t)
+        cv2.idft(spectrum, plane, cv2.DFT_REAL_OUTPUT)
+        if timer is not None:
+            t = timer.stop('ifft', t)
+
+        dstimg = plane[:h, :w]
+        np.absolute(dstimg, dstimg)
+        if dst is None:
+            dst = np.uint8(dstimg)
+        else:
+            dst[...] = dstimg
+        if timer is not None:
+            timer.stop('convert', t)
+        return dst
+
+    def getTiledButterworthBlur(self, img, stopband2=5, order=3, dst=None,
+            timer=None):
+        """
+        Apply the Butterworth low-pass filter block by block.
+
+        The stopband of the filter is a few cycles per image, so its
+        kernel is as large as the image and overlap-save tiles would
+        need overlaps as large as the image too. Instead, the spectrum
+        is only computed for the (2K+1)^2 low frequencies where the gain
+        is over self.tolerance (see getBandLimit): each tile adds its
+        part of these coefficients with two small matrix products, then
+        each tile of the result is made from them the same way. The
+        result matches the unpadded whole image filter (padToOptimal=
+        False) within the tolerance.
+
+        Only a tile, its products and the coefficients are in memory at
+        a time, so img and dst can be numpy.memmap. With tileWorkers > 1
+        the tiles run in threads (numpy releases the GIL in the matrix
+        products).
+
+        @param  dst     uint8 array in the shape of img to write into,
+                        or None for a new one
+        @return dst
+        """
+        h, w = img.shape[0], img.shape[1]
+        bandLimit = getBandLimit(stopband2, order, self.tolerance)
+        if 2 * bandLimit + 1 > min(h, w):
+            # The low frequencies are the whole spectrum
+            return self._getWholeButterworthBlur(img, stopband2, order,
+                dst, timer)
+        if dst is None:
+            dst = np.empty((h, w), np.uint8)
+        if timer is not None:
+            t = timer.start()
+
+        freqs = np.arange(-bandLimit, bandLimit + 1)
+        # Forward DFT bases, the inverse uses their conjugates
+        rowBasis = np.complex64(np.exp(-2j * np.pi / h *
+            np.outer(freqs, np.arange(h))))
+        colBasis = np.complex64(np.exp(-2j * np.pi / w *
+            np.outer(np.arange(w), freqs)))
+        r2 = np.float64(freqs[:, np.newaxis] ** 2 + freqs[np.newaxis, :] ** 2)
+        gain = butterworthGain(r2, stopband2, order)
+        if timer is not None:
+            t = timer.stop('filterBuild', t)
+
+        def getCoefficients(tile):
+            y0, y1, x0, x1 = tile
+            block = np.float32(img[y0:y1, x0:x1])
+            return np.dot(rowBasis[:, y0:y1], np.dot(block, colBasis[x0:x1]))
+
+        def filterTile(tile):
+            y0, y1, x0, x1 = tile
+            block = np.dot(np.dot(rowBasis[:, y0:y1].conj().T, coefficients),
+                colBasis[x0:x1].conj().T).real
+            np.absolute(block, block)
+            dst[y0:y1, x0:x1] = np.uint8(block)
+
+        tiles = getTiles((h, w), self.tileSize)
+        pool = ThreadPool(self.tileWorkers) if self.tileWorkers > 1 else None
+        try:
+            mapTiles = pool.map if pool is not None else map
+            spectrum = np.zeros((len(freqs), len(freqs)), np.complex128)
+            for part in mapTiles(getCoefficients, tiles):
+                spectrum += part
+            coefficients = np.complex64(spectrum * gain / (h * w))
+            if timer is not None:
+                t = timer.stop('fft', t)
+            mapTiles(filterTile, tiles)
+            if timer is not None:
+                timer.stop('ifft', t)
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+        return dst
+
+# Shared by all the SingleImageProcess instances
+defaultFilterBank = ButterworthFilterBank()
+defaultEngine = FrequencyEngine()
@@ -0,0 +1,187 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015-2016, Xuyang Hu <xuyanghu@yahoo.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License version 2.1
+# as published by the Free Software Foundation
+
+"""
+imageCache keeps filtered images on disk between batch runs.
+
+An entry is keyed by the file path, its mtime and size, the ROI and the
+filter parameters (including the FFT padding of
+frequencyFilter.defaultEngine, which batchPipeline filters with), so
+editing or replacing an image invalidates it.
+"""
+
+import hashlib
+import os
+
+import numpy as np
+
+from frequencyFilter import defaultEngine
+
+# pylint: disable=C0103,R0904,W0102,W0201
+
+# Bump when the filter output changes so that old entries are not used
+CACHE_VERSION = 2
+
+class FilteredImageCache(object):
+    """
+    A size capped directory of filtered images stored as .npy files.
+
+    When the directory grows over maxBytes, the least recently used
+    entries are removed. The object only holds the directory, the cap
+    and the hit/miss counters, so it can be sent to worker processes.
+    The copies of the workers are lost: the caller adds their counts,
+    and the bytes they wrote with addEntryBytes.
+    """
+
+    def __init__(self, cacheDir, maxBytes=1 << 30):
+        self.cacheDir = cacheDir
+        self.maxBytes = maxBytes
+        self.hits = 0
+        self.misses = 0
+        # Bytes of the entries stored by this copy of the cache
+        self.writtenBytes = 0
+        if not os.path.isdir(cacheDir):
+            os.makedirs(cacheDir)
+        self.totalBytes = self.getDiskUsage()
+        if self.totalBytes > self.maxBytes:
+            self.evict()
+
+    def getEntryPath(self, path, roi=None, stopband2=5, scale=1):
+        """
+        Return the cache file of the filtered image, whether it exists
+        or not.
+
+        @param  scale   decoding scale, see batchPipeline.loadImage
+        """
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        roi = tuple(roi) if roi else None
+        key = (CACHE_VERSION, path, stat.st_mtime, stat.st_size, roi,
+            stopband2, defaultEngine.padToOptimal)
+        if scale != 1:
+            # Keeps the keys of the full size entries unchanged
+            key += (scale,)
+        key = repr(key)
+        return os.path.join(self.cacheDir,
+            hashlib.sha1(key).hexdigest() + '.npy')
+
+    def get(self, path, roi=None, stopband2=5, scale=1):
+        """
+        Return the cached filtered image, or None on a miss.
+        """
+        img = self.load(path, roi, stopband2, scale)
+        if img is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return img
+
+    def load(self, path, roi=None, stopband2=5, scale=1):
+        """
+        Like get but without counting the hit or miss, so it can be
+        called from other threads.
+        """
+        entryPath = self.getEntryPath(path, roi, stopband2, scale)
+        try:
+            img = np.load(entryPath)
+        except (IOError, ValueError):
+            return None
+        try:
+            # mtime tracks the last use for the eviction
+            os.utime(entryPath, None)
+        except OSError:
+            pass
+        return img
+
+    def put(self, path, img, roi=None, stopband2=5, scale=1):
+        """
+        Store the filtered image and evict old entries when needed.
+        """
+        entryPath = self.getEntryPath(path, roi, stopband2, scale)
+        tmpPath = '%s.%d.tmp' % (entryPath, os.getpid())
+        with open(tmpPath, 'wb') as f:
+            np.save(f, img)
+        try:
+            os.rename(tmpPath, entryPath)
+        except OSError:
+            # Another process stored the same entry first
+            os.remove(tmpPath)
+            return
+        size = os.path.getsize(entryPath)
+        self.writtenBytes += size
+        self.addEntryBytes(size)
+
+    def addEntryBytes(self, size):
+        """
+        Count size bytes of new entries, e.g. written by a worker
+        process, and evict old entries when the cache is over maxBytes.
+        """
+        self.totalBytes += size
+        if self.totalBytes > self.maxBytes:
+            self.evict()
+
+    def evict(self):
+        """
+        Remove the least recently used entries until the cache is back
+        under 90% of maxBytes.
+        """
+        entries = []
+        for fileName in os.listdir(self.cacheDir):
+            if not fileName.endswith('.npy'):
+                continue
+            entryPath = os.path.join(self.cacheDir, fileName)
+            try:
+                stat = os.stat(entryPath)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entryPath))
+        entries.sort()
+
+        self.totalBytes = sum(entry[1] for entry in entries)
+        for mtime, size, entryPath in entries:
+            if self.totalBytes <= self.maxBytes * 0.9:
+                break
+            try:
+                os.remove(entryPath)
+            except OSError:
+                pass
+            self.totalBytes -= size
+
+    def getDiskUsage(self):
+        """
+        Return the bytes used by the entries in the cache directory.
+        """
+        total = 0
+        for fileName in os.listdir(self.cacheDir):
+            if fileName.endswith('.npy'):
+                try:
+                    total += os.path.getsize(
+                        os.path.join(self.cacheDir, fileName))
+                except OSError:
+                    pass
+        return total
+
+    def clear(self):
+        """
+        Remove all the entries.
+        """
+        for fileName in os.listdir(self.cacheDir):
+            if fileName.endswith('.npy'):
+                os.remove(os.path.join(self.cacheDir, fileName))
+        self.totalBytes = 0
+
+    def getStats(self):
+        """
+        Return hit/miss counts and the disk usage in a dict.
+        """
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'bytes': self.totalBytes,
+            'maxBytes': self.maxBytes}
@@ -0,0 +1,156 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015-2016, Xuyang Hu <xuyanghu@yahoo.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License version 2.1
+# as published by the Free Software Foundation
+
+"""
+imageMetrics computes the values reported for each image.
+
+All functions work on plain numpy arrays, so they are shared by
+SingleImageProcess and the streaming batch pipeline.
+"""
+
+import cv2
+
+import imageStats
+from imageSampling import SampleGrid
+
+# pylint: disable=C0103,R0904,W0102,W0201
+
+def getAvgIn4x4rect(img, LocX=2, LocY=2):
+    """
+    Calculate average value of a 4x4 rect in the image.
+
+    Note:   this function do not check if the rect is fully
+            inside the image!
+
+    @param  (LocX, LocY)    start point of rect
+    @reutrn retval          average value in float
+    """
+    imROI = img[LocX:LocX+4, LocY:LocY+4]
+    return cv2.mean(imROI)[0]
+
+def getCenterPoint(img):
+    """
+    Return the average of the 4x4 rect in the center of image.
+    """
+    return getAvgIn4x4rect(img, img.shape[0]/2 - 2, img.shape[1]/2 - 2)
+
+def getPointsInACol(img, LocX=0, pointCount=10):
+    """
+    Return the 4x4 averages of pointCount points evenly spaced along Y
+    when x = LocX.
+    """
+    return list(SampleGrid.fromCol(img.shape, LocX, pointCount).sample(img))
+
+def getPointsInARow(img, LocY=0, pointCount=10):
+    """
+    Return the 4x4 averages of pointCount points evenly spaced along X
+    when y = LocY.
+    """
+    return list(SampleGrid.fromRow(img.shape, LocY, pointCount).sample(img))
+
+def getAverageValue(img):
+    return cv2.mean(img)[0]
+
+def getShannonEntropy(img):
+    """
+    calculate the shannon entropy for an image
+    """
+    return float(imageStats.getEntropy(imageStats.getHistograms(img)))
+
+# Metrics known by measureAll, in the order they are reported
+METRICS = ('center', 'col', 'row', 'samples', 'centerWithoutShift',
+    'entropy', 'average', 'histogram')
+
+def measureAll(img, plan):
+    """
+    Compute all the metrics of plan on image in one go.
+
+    The center point and the histogram are computed once and shared by
+    the metrics that need them.
+
+    @param  plan    {metric name: args}, args is () for all the metrics
+                    but 'col' (LocX, pointCount=10) and
+                    'row' (LocY, pointCount=10) and 'samples' (grid,)
+                    with a imageSampling.SampleGrid. 'histogram' is the
+                    256 bins histogram, see imageStats.
+    @return         {metric name: value}
+    """
+    unknown = set(plan) - set(METRICS)
+    if unknown:
+        raise ValueError("Unknown metrics: " + ', '.join(sorted(unknown)))
+
+    result = {}
+    if 'center' in plan or 'centerWithoutShift' in plan:
+        center = getCenterPoint(img)
+    if set(plan) & set(('entropy', 'average', 'centerWithoutShift',
+            'histogram')):
+        histogram = imageStats.getHistograms(img)
+        average = float(imageStats.getMean(histogram))
+
+    if 'center' in plan:
+        result['center'] = center
+    if 'col' in plan:
+        result['col'] = getPointsInACol(img, *plan['col'])
+    if 'row' in plan:
+        result['row'] = getPointsInARow(img, *plan['row'])
+    if 'samples' in plan:
+        result['samples'] = plan['samples'][0].sample(img)
+    if 'centerWithoutShift' in plan:
+        result['centerWithoutShift'] = center - average
+    if 'entropy' in plan:
+        result['entropy'] = float(imageStats.getEntropy(histogram))
+    if 'average' in plan:
+        result['average'] = average
+    if 'histogram' in plan:
+        result['histogram'] = histogram
+    return result
+
+def measureStack(imgs, plan):
+    """
+    Compute the metrics of plan on a stack of same sized images.
+
+    Each metric is computed for the whole stack with vectorized numpy,
+    the results are the same as measureAll on each image.
+
+    @param  imgs    uint8 array in shape (N, height, width)
+    @return         [{metric name: value}] with one dict per image
+    """
+    unknown = set(plan) - set(METRICS)
+    if unknown:
+        raise ValueError("Unknown metrics: " + ', '.join(sorted(unknown)))
+
+    count, h, w = imgs.shape
+    columns = {}
+    if 'center' in plan or 'centerWithoutShift' in plan:
+        center = imgs[:, h/2 - 2:h/2 + 2, w/2 - 2:w/2 + 2].mean(axis=(1, 2))
+    if set(plan) & set(('entropy', 'average', 'centerWithoutShift',
+            'histogram')):
+        histograms = imageStats.getHistograms(imgs)
+        average = imageStats.getMean(histograms)
+
+    if 'center' in plan:
+        columns['center'] = center.tolist()
+    if 'col' in plan:
+        columns['col'] = SampleGrid.fromCol((h, w),
+            *plan['col']).sampleStack(imgs).tolist()
+    if 'row' in plan:
+        columns['row'] = SampleGrid.fromRow((h, w),
+            *plan['row']).sampleStack(imgs).tolist()
+    if 'samples' in plan:
+        columns['samples'] = list(plan['samples'][0].sampleStack(imgs))
+    if 'centerWithoutShift' in plan:
+        columns['centerWithoutShift'] = (center - average).tolist()
+    if 'entropy' in plan:
+        columns['entropy'] = imageStats.getEntropy(histograms).tolist()
+    if 'average' in plan:
+        columns['average'] = average.tolist()
+    if 'histogram' in plan:
+        columns['histogram'] = list(histograms)
+    return [dict((name, values[i]) for name, values in columns.items())
+        for i in range(count)]
@@ -15,30 +15,24 @@ This file can be test standalone using cmd:
 """
 
 import cv2
-import os
-import re
 import sys
-import matplotlib.pyplot as plt
 import numpy as np
 from PySide import QtGui, QtCore
-import math
 
 import time
 
+from frequencyFilter import defaultFilterBank, defaultEngine, getShiftedDFT
+import imageMetrics
+from imageSampling import RoiStatistics
+# The batch classes live in the Qt free batchProcesser, they are still
+# imported from here by the UI
+from batchProcesser import metricTitles, fileExp, BatchCancelled, \
+    BatchProcessing, getSampleArgs, plotGraphs
+
 # pylint: disable=C0103,R0904,W0102,W0201
 
 testPath = './lena.jpeg'
 
-def fileExp(matchedSuffixes=['bmp', 'jpg', 'jpeg', 'png']):
-    """
-    Returns a compiled regexp matcher object for given list of suffixes.
-    """
-
-    # Create a regular expression string to match all the suffixes
-    matchedString = r'|'.join([r'^.*\.' + s + '$' for s in matchedSuffixes])
-
-    return re.compile(matchedString, re.IGNORECASE)
-
 class SingleImageProcess(QtCore.QObject):
     """
     Process single image.
@@ -51,26 +45,43 @@ class SingleImageProcess(QtCore.QObject):
     sel = None # can be set from outside
     selSignal = QtCore.Signal(list)
 
-    def __init__(self, fileName=testPath, isGray=False, parent=None):
+    def __init__(self, fileName=testPath, isGray=False, parent=None,
+            img=None, viewer=None):
         """
         Load the image in gray scale (isGray=False)
+
+        @param  img     image already decoded from fileName, it is then
+                        not read again
+        @param  viewer  mainUI.OutputViewer the images are shown in, they
+                        are shown with highgui when it is None
         """
         super(SingleImageProcess, self).__init__(parent)
 
         self.fileName = fileName
-        self.img = cv2.imread(fileName, isGray)
+        if img is None:
+            img = cv2.imread(fileName, isGray)
+        self.img = img
+        self.viewer = viewer
         # private for safty
         self.dragStart = None
         self.roiNeedUpadte = False 
+        # ROI selection, see onMouse
+        self.view = None
+        self.roiStats = None
+        self.selectionImg = None
+        self.drawnSel = None
+        self.lastSelectionTime = 0
 
         self.isInWaitLoop = False
 
     def simpleDemo(self):
         """
         Print image shape and gray level info 
-        And show the image with highgui.
+        And show the image in the viewer, or with highgui.
 
-        Usage: press esc to quit image window.
+        Usage: drag to select a ROI and press a to accept it, press b
+        for the Butterworth blur and d for the spectrum. With highgui,
+        press esc to quit image window.
         """
         width, height = self.img.shape
         meanVal, meanStdDevVal = cv2.meanStdDev(self.img)
@@ -79,32 +90,49 @@ class SingleImageProcess(QtCore.QObject):
         print (width, height)
         print "(min, max, mean, meanStdDev):"
         print (minVal, maxVal, meanVal[0][0], meanStdDevVal[0][0])
+        if self.viewer is not None:
+            # Returns at once, the keys and the mouse are handled from
+            # the Qt event loop
+            self.view = self.viewer.showImage("SingleImageWindow", self.img)
+            self.view.setMouseCallback(self.onMouse)
+            self.view.setKeyCallback(self.onKey)
+            return
         cv2.imshow("SingleImageWindow", self.img)
         cv2.setMouseCallback("SingleImageWindow", self.onMouse)
         print "Press esc to exit" # any key except q in fact
         self.isInWaitLoop = True
         while True:
             ch = cv2.waitKey()
-            if ch == 27: # ESC
-                break
-            elif self.roiNeedUpadte and ch == 97: # selection is made
-                print "Accept ROI (minX, minY, maxX, maxY): " +  str(self.sel)
-                self.selSignal.emit(self.sel)
-                self.setROI()
-                self.roiNeedUpadte = False
+            if ch == 27 or self.onKey(ch): # ESC or ROI accepted
                 break
-            elif ch == ord('b'):
-                self.getButterworthBlur(stopband2=35, showResult=True)
         cv2.destroyAllWindows()
         self.isInWaitLoop = False
 
+    def onKey(self, ch):
+        """
+        Handle a key pressed in the image window.
+
+        @return     True when the ROI was accepted
+        """
+        if self.roiNeedUpadte and ch == 97: # selection is made
+            print "Accept ROI (minX, minY, maxX, maxY): " +  str(self.sel)
+            self.selSignal.emit(self.sel)
+            self.setROI()
+            self.roiNeedUpadte = False
+            return True
+        elif ch == ord('b'):
+            self.getButterworthBlur(stopband2=35, showResult=True)
+        elif ch == ord('d'):
+            self.getDFT(showdft=True)
+        return False
+
     def setROI(self, showPatch=False):
         if not(self.sel):
             return self.img
-        patch = self.img[self.sel[1]:self.sel[3],self.sel[0]:self.sel[2]]
+        # A compact copy, so the full image can be freed
+        patch = self.img[self.sel[1]:self.sel[3],self.sel[0]:self.sel[2]].copy()
         if showPatch:
-            cv2.imshow("patch", patch)
-            self.enterWaitLoop()
+            self.showImage(patch, "patch")
         self.roiNeedUpadte = False
         return patch
 
@@ -113,8 +141,8 @@ class SingleImageProcess(QtCore.QObject):
         Save the file with the time stamp.
         """
         # TODO: make it work!!
-        print "This function has not been implemented yet. It is recommand to "+
-            " use matplotlib instead."
+        print ("This function has not been implemented yet. It is recommand to "+
+            " use matplotlib instead.")
         return False
         # newName = time.strftime('%Y%m%d_%H%M%S') + self.fileName
         # if cv2.imwrite(newName, self.img):
@@ -126,13 +154,9 @@ class SingleImageProcess(QtCore.QObject):
     # --------------------------------------------------- Get image info
     def getCenterPoint(self):
         """
-        Blur image and return the center point of image.
+        Return the average of the 4x4 rect in the center of image.
         """
-        gaussianImg = cv2.GaussianBlur(self.img, (9,9), 3)
-        centerPoint = self.getAvgIn4x4rect(
-            self.img.shape[0]/2 - 2, 
-            self.img.shape[1]/2 - 2)
-        return centerPoint
+        return imageMetrics.getCenterPoint(self.img)
 
     def getAvgIn4x4rect(self, LocX=2, LocY=2):
         """
@@ -144,8 +168,7 @@ class SingleImageProcess(QtCore.QObject):
         @param  (LocX, LocY)    start point of rect
         @reutrn retval          average value in float
         """
-        imROI = self.img[LocX:LocX+4, LocY:LocY+4]
-        return cv2.mean(imROI)[0]
+        return imageMetrics.getAvgIn4x4rect(self.img, LocX, LocY)
 
     def getGaussaianBlur(self, size=(33,33)):
         """
@@ -159,31 +182,30 @@ class SingleImageProcess(QtCore.QObject):
         """
         Apply Butterworth filter to image.
 
+        The filter runs on the real-input FFT of frequencyFilter, see
+        FrequencyEngine for the padding of the image.
+
         @param      stopband2       stopband^2
         """
-        dft4img = self.getDFT()
-        bwfilter = self.getButterworthFilter(stopband2=stopband2)
-        dstimg = dft4img * bwfilter
-        dstimg = cv2.idft(np.fft.ifftshift(dstimg))
-        dstimg = np.uint8(cv2.magnitude(dstimg[:,:,0], dstimg[:,:,1]))
-        if showResult:
-            # cv2.imshow("test", dstimg)
-            # self.enterWaitLoop()
+        dstimg = defaultEngine.getButterworthBlur(self.img, stopband2=stopband2)
+        if showResult and self.viewer is not None:
+            self.showImage(dstimg, "Butterworth blur", keepView=True)
+        elif showResult:
+            import matplotlib.pyplot as plt
             plt.imshow(dstimg)
             plt.show()
         return dstimg
  
     def getAverageValue(self):
-        return cv2.mean(self.img)[0]
+        return imageMetrics.getAverageValue(self.img)
 
     def getDFT(self, img2dft=None, showdft=False):
         """
         Return the spectrum in log scale.
         """
-        if img2dft == None:
+        if img2dft is None:
             img2dft = self.img
-        dft_A = cv2.dft(np.float32(self.img),flags = cv2.DFT_COMPLEX_OUTPUT|cv2.DFT_SCALE)
-        dft_A = np.fft.fftshift(dft_A)
+        dft_A = getShiftedDFT(img2dft)
 
         if showdft:
             self.showSpecturm(dft_A)
@@ -192,23 +214,16 @@ class SingleImageProcess(QtCore.QObject):
     def getButterworthFilter(self, stopband2=5, order=3, showdft=False):
         """
         Get Butterworth filter in frequency domain.
+
+        The mask is single channel float32 and shared through
+        frequencyFilter.defaultFilterBank, so do not modify it.
         """
-        h, w = self.img.shape[0], self.img.shape[1] # no optimization
-        P = h/2
-        Q = w/2
-        dst = np.zeros((h, w, 2), np.float64)
-        for i in range(h):
-            for j in range(w):
-                r2 = float((i-P)**2+(j-Q)**2)
-                if r2 == 0:
-                    r2 = 1.0
-                dst[i,j] = 1/(1+(r2/stopband2)**order)
-        dst = np.float64(dst)
-        if showdft:
-            f = cv2.magnitude(dst[:,:,0], dst[:,:,1])
-            # cv2.imshow("butterworth", f)
-            # self.enterWaitLoop()
-            plt.imshow(f)
+        dst = defaultFilterBank.getFilter(self.img.shape, stopband2, order)
+        if showdft and self.viewer is not None:
+            self.showImage(dst, "Butterworth filter")
+        elif showdft:
+            import matplotlib.pyplot as plt
+            plt.imshow(dst)
             plt.show()
         return dst
 
@@ -216,28 +231,27 @@ class SingleImageProcess(QtCore.QObject):
         """
         calculate the shannon entropy for an image
         """
-        if not(srcImage):
+        if srcImage is None:
             srcImage = self.img
-        histogram = cv2.calcHist(srcImage, [0],None,[256],[0,256])
-        histLen = sum(histogram)
-
-        samplesPossiblity = [float(h) / histLen for h in histogram]
-
-        return -sum([p * math.log(p, 2) for p in samplesPossiblity if p != 0])
+        return imageMetrics.getShannonEntropy(srcImage)
 
     # ------------------------------------------------ Highgui functions       
-    def showImage(self, img):
+    def showImage(self, img, title="test", keepView=False):
         """
-        Show input image with highgui.
+        Show input image in the viewer, or with highgui.
+
+        @param  keepView    keep the zoom of the viewer
         """
-        cv2.imshow("test", img)
+        if self.viewer is not None:
+            return self.viewer.showImage(title, img, keepView)
+        cv2.imshow(title, img)
         self.enterWaitLoop()
 
     def showSpecturm(self, dft_result):
         """
         Show spectrun graph.
         """
-        cv2.normalize(dft_result, dft_result, 0.0, 1.0, cv2.cv.CV_MINMAX)
+        cv2.normalize(dft_result, dft_result, 0.0, 1.0, cv2.NORM_MINMAX)
         # Split fourier into real and imaginary parts
         image_Re, image_Im = cv2.split(dft_result)
 
@@ -248,31 +262,71 @@ class SingleImageProcess(QtCore.QObject):
         log_spectrum = cv2.log(1.0 + magnitude)
 
         # normalize and display the results as rgb
-        cv2.normalize(log_spectrum, log_spectrum, 0.0, 1.0, cv2.cv.CV_MINMAX)
-        cv2.imshow("Spectrum", log_spectrum)
-        self.enterWaitLoop()
+        cv2.normalize(log_spectrum, log_spectrum, 0.0, 1.0, cv2.NORM_MINMAX)
+        self.showImage(log_spectrum, "Spectrum")
 
     def onMouse(self, event, x, y, flags, param):
         """
         Mouse callback funtion for setting ROI.
+
+        The mean and the entropy of the selection are shown while it is
+        dragged, see imageSampling.RoiStatistics.
         """
         if event == cv2.EVENT_LBUTTONDOWN:
             self.dragStart = x, y
             self.sel = 0,0,0,0
+            if self.roiStats is None:
+                self.roiStats = RoiStatistics(self.img)
         elif self.dragStart:
             #print flags
             if flags & cv2.EVENT_FLAG_LBUTTON:
                 minpos = min(self.dragStart[0], x), min(self.dragStart[1], y)
                 maxpos = max(self.dragStart[0], x), max(self.dragStart[1], y)
                 self.sel = minpos[0], minpos[1], maxpos[0], maxpos[1]
-                img = cv2.cvtColor(self.img, cv2.COLOR_GRAY2BGR)
-                cv2.rectangle(img, (self.sel[0], self.sel[1]), (self.sel[2], self.sel[3]), (0,255,255), 1)
-                cv2.imshow("SingleImageWindow", img)
+                self.showSelection()
             else:
+                self.showSelection(force=True)
                 print "selection is complete. Press a to accept."
+                print "ROI " + self.getSelectionLabel()
                 self.roiNeedUpadte = True
                 self.dragStart = None
 
+    def getSelectionLabel(self):
+        return "mean %.1f, entropy %.2f" % (self.roiStats.getMean(self.sel),
+            self.roiStats.getEntropy(self.sel))
+
+    def showSelection(self, force=False):
+        """
+        Draw the selection over the image.
+
+        @param  force   draw even if the last one was drawn less than a
+                        display refresh ago (highgui only, the viewer
+                        throttles the mouse moves itself)
+        """
+        if self.view is not None:
+            self.view.setSelection(self.sel, self.getSelectionLabel())
+            return
+        # highgui: the image is converted once, and the previous
+        # rectangle is erased by copying back the gray pixels under it
+        now = time.time()
+        if not force and now - self.lastSelectionTime < 1.0 / 60:
+            return
+        self.lastSelectionTime = now
+        if self.selectionImg is None:
+            self.selectionImg = cv2.cvtColor(self.img, cv2.COLOR_GRAY2BGR)
+        if self.drawnSel is not None:
+            minX, minY, maxX, maxY = self.drawnSel
+            for rows, cols in ((slice(minY, maxY + 1), slice(minX, minX + 1)),
+                    (slice(minY, maxY + 1), slice(maxX, maxX + 1)),
+                    (slice(minY, minY + 1), slice(minX, maxX + 1)),
+                    (slice(maxY, maxY + 1), slice(minX, maxX + 1))):
+                self.selectionImg[rows, cols] = \
+                    self.img[rows, cols][:, :, np.newaxis]
+        cv2.rectangle(self.selectionImg, (self.sel[0], self.sel[1]),
+            (self.sel[2], self.sel[3]), (0,255,255), 1)
+        self.drawnSel = self.sel
+        cv2.imshow("SingleImageWindow", self.selectionImg)
+
     def enterWaitLoop(self):
         """
         Enter waitKey loop.
@@ -291,178 +345,6 @@ class SingleImageProcess(QtCore.QObject):
             cv2.destroyAllWindows()
             self.isInWaitLoop = False
 
-class BatchProcessing():
-    """
-    Process all the images in the given folder.
-    """
-
-    resultArray = []
-    globalROI = None
-
-    def __init__(self, rootPath='./', roi=None):
-        print "Batch path: " + rootPath
-        if not os.path.isdir(rootPath):
-            rootPath = repr(rootPath)[2:-1]
-            if not os.path.isdir(rootPath):
-                return
-        self.rootPath = rootPath
-        self.listPaths = []
-        self.listFileNames = []
-        for fileName in os.listdir(rootPath):
-            if fileExp().match(fileName):
-                absPath = os.path.join(self.rootPath, fileName)
-                self.listPaths.append(absPath)
-                self.listFileNames.append(fileName)
-        print "Files count: " + str(len(self.listFileNames))
-        print self.listFileNames
-        
-        self.processQueue = []
-
-        if roi:
-            self.globalROI = roi
-
-        self.loadImages()
-
-    def loadImages(self):
-        """
-        Load all the images in the selected folder.
-        """
-        for path in self.listPaths:
-            im = SingleImageProcess(fileName=path)
-            im.sel = self.globalROI
-            im.img = im.setROI()
-            # im.img = im.getGaussaianBlur()
-            im.img = im.getButterworthBlur()
-            self.processQueue.append(im)
-
-    def getCenterPoints(self, showResult=False):
-        """
-        Calculate center points of all the iamges and save them into resultArray
-        """
-        print "============== Getting Center Point =========="
-        centerPoints = []
-        for im in self.processQueue:
-            pcenter = im.getCenterPoint()
-            centerPoints.append(pcenter)
-
-        if showResult:
-            plt.plot(self.resultArray)
-            plt.title('Center Points')
-            plt.xlabel('Picture numbers')
-            plt.ylabel('Gray scale')
-            plt.show()
-        self.resultArray = centerPoints
-        return centerPoints
-
-    def getPointsInACol(self, LocX=0, pointCount=10, showResult=False):
-        """
-        Return value of pointCount=10 points when x = LocX
-        resultArray includes pointCount=10 arrays, each array 
-        has len(self.processQueue) numbers in float.
-        """
-        print "========================= getPointsInACol =========================="
-        self.resultArray = [[]]*pointCount
-        height = self.processQueue[0].img.shape[1]
-        yInterval = height/pointCount
-        for i in range(pointCount):
-            tmpArr = []
-            for im in self.processQueue:
-                avg4x4Val = im.getAvgIn4x4rect(LocX, i*yInterval)
-                tmpArr.append(avg4x4Val)
-            self.resultArray[i] = tmpArr
-
-        if showResult:
-            plt.plot(range(0,height,yInterval), self.resultArray)
-            plt.title('Points in a col when x==' + str(LocX) )
-            plt.xlabel('Y position')
-            plt.ylabel('Gray scale')
-            plt.show()
-        return self.resultArray
-
-    def getPointsInARow(self, LocY=0, pointCount=10, showResult=False):
-        """
-        Return value of pointCount=10 points when y = LocY
-        resultArray includes pointCount=10 arrays, each array 
-        has len(self.processQueue) numbers in float.
-        """
-        print "========================= getPointsInARow =========================="
-        self.resultArray = [[]]*pointCount
-        width = self.processQueue[0].img.shape[0]
-        xInterval = width/pointCount
-        for i in range(pointCount):
-            tmpArr = []
-            for im in self.processQueue:
-                avg4x4Val = im.getAvgIn4x4rect(i*xInterval, LocY)
-                tmpArr.append(avg4x4Val)
-            self.resultArray[i] = tmpArr
-
-        if showResult:
-            plt.plot(range(0,width,xInterval), self.resultArray)
-            plt.title('Points in a row when y==' + str(LocY) )
-            plt.xlabel('X position')
-            plt.ylabel('Gray scale')
-            plt.show()
-        return self.resultArray
-
-    def getAverageValues(self, showResult=False):
-        """
-        Return average value of all images.
-        """
-        averageArr = []
-        for im in self.processQueue:
-            averageArr.append(im.getAverageValue())
-        if showResult:
-            plt.plot(range(len(self.processQueue)), averageArr)
-            plt.title('Average value')
-            plt.xlabel('Picture numbers')
-            plt.ylabel('Gray scale')
-            plt.show()
-        return averageArr
-
-    def getCenterPointsWithoutShift(self, LocX=0, pointCount=10, showResult=False):
-        """
-        Return gray scale of center points removing average value
-        as global shift.
-        """
-        centerPoints = self.getCenterPoints()
-        avgPoints = self.getAverageValues()
-        dstPoints = np.subtract(centerPoints, avgPoints)
-        self.resultArray = dstPoints
-
-        if showResult:
-            plt.plot(dstPoints)
-            plt.title('Center value without shift')
-            plt.xlabel('Picture numbers')
-            plt.ylabel('Center Point\'s Gray scale')
-            plt.show()
-
-        return dstPoints
-
-    def getShannonEntropies(self, showResult=False):
-        """
-        Return average value of all images.
-        """
-        entropyArr = []
-        for im in self.processQueue:
-            entropyArr.append(im.getShannonEntropy())
-        if showResult:
-            plt.plot(range(len(self.processQueue)), entropyArr)
-            plt.title('Entropy value')
-            plt.xlabel('Picture numbers')
-            plt.ylabel('Entropy')
-            plt.show()
-        return entropyArr
-
-def plotGraphs(dataArr):
-    dataCount = len(dataArr)
-    graphLayout = 2 * 100 + (dataCount / 2)*10 + 1
-    for i,data in enumerate(dataArr):
-        plt.subplot(graphLayout + i)
-        plt.plot(data)
-    plt.show()
-
-
-
 if __name__ == "__main__":
     """
     Following codes are for test. 
@@ -484,4 +366,4 @@ if __name__ == "__main__":
     avgArr = batchTest.getAverageValues(showResult=True)
     batchTest.getCenterPointsWithoutShift(50, showResult=True)
     entpArr = batchTest.getShannonEntropies(showResult=True)
-    plotGraphs([avgArr, entpArr])
\ No newline at end of file
+    plotGraphs([avgArr, entpArr])
@@ -0,0 +1,264 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015-2016, Xuyang Hu <xuyanghu@yahoo.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License version 2.1
+# as published by the Free Software Foundation
+
+"""
+imageSampling averages many small sample rects of an image at once.
+
+Like getAvgIn4x4rect, a sample at (LocX, LocY) covers
+img[LocX:LocX+size, LocY:LocY+size], so LocX is the row index.
+"""
+
+import hashlib
+
+import cv2
+import numpy as np
+
+import imageStats
+
+# pylint: disable=C0103,R0904,W0102,W0201
+
+class SampleGrid(object):
+    """
+    A list of size x size sample rects.
+
+    Rects are clipped to the image, a rect fully outside of it gives 0.
+    Dense grids are evaluated from the integral image, a few points
+    are gathered directly, so the cost per image is one pass at most.
+    """
+
+    def __init__(self, locXs, locYs, size=4):
+        self.locXs = np.asarray(locXs, dtype=np.intp).ravel()
+        self.locYs = np.asarray(locYs, dtype=np.intp).ravel()
+        if self.locXs.shape != self.locYs.shape:
+            raise ValueError("locXs and locYs must have the same length")
+        self.size = size
+
+    def __len__(self):
+        return len(self.locXs)
+
+    def getKey(self):
+        """
+        Return a short string which identifies the rects of the grid.
+        """
+        digest = hashlib.md5(self.locXs.tobytes())
+        digest.update(self.locYs.tobytes())
+        digest.update(str(self.size))
+        return digest.hexdigest()[:12]
+
+    @classmethod
+    def fromCol(cls, shape, LocX=0, pointCount=10, size=4):
+        """
+        pointCount points evenly spaced along Y when x = LocX.
+        """
+        yInterval = shape[1]/pointCount
+        return cls([LocX] * pointCount, np.arange(pointCount) * yInterval,
+            size)
+
+    @classmethod
+    def fromRow(cls, shape, LocY=0, pointCount=10, size=4):
+        """
+        pointCount points evenly spaced along X when y = LocY.
+        """
+        xInterval = shape[0]/pointCount
+        return cls(np.arange(pointCount) * xInterval, [LocY] * pointCount,
+            size)
+
+    @classmethod
+    def fromGrid(cls, locXs, locYs, size=4):
+        """
+        All the (LocX, LocY) combinations, LocY varying fastest.
+        """
+        gridX, gridY = np.meshgrid(locXs, locYs, indexing='ij')
+        return cls(gridX, gridY, size)
+
+    @classmethod
+    def fromEvenGrid(cls, shape, xCount=10, yCount=10, size=4):
+        """
+        xCount x yCount points evenly spaced over an image of shape.
+        """
+        return cls.fromGrid(np.arange(xCount) * (shape[0]/xCount),
+            np.arange(yCount) * (shape[1]/yCount), size)
+
+    @classmethod
+    def fromPoints(cls, points, size=4):
+        """
+        Rects starting at the given [(LocX, LocY), ...].
+        """
+        points = np.asarray(points, dtype=np.intp).reshape(-1, 2)
+        return cls(points[:, 0], points[:, 1], size)
+
+    def sample(self, img):
+        """
+        Return the average value of every rect in img.
+
+        @return     float64 array in shape (len(self),)
+        """
+        h, w = img.shape[0], img.shape[1]
+        x0 = np.clip(self.locXs, 0, h)
+        x1 = np.clip(self.locXs + self.size, 0, h)
+        y0 = np.clip(self.locYs, 0, w)
+        y1 = np.clip(self.locYs + self.size, 0, w)
+        area = (x1 - x0) * (y1 - y0)
+
+        if len(self) * self.size ** 2 * 4 < h * w:
+            sums = self._gatherSums(img, x0, x1, y0, y1, area)
+        else:
+            integral = cv2.integral(img, sdepth=cv2.CV_64F)
+            sums = (integral[x1, y1] - integral[x0, y1]
+                - integral[x1, y0] + integral[x0, y0])
+        return np.where(area > 0, sums / np.maximum(area, 1), 0.0)
+
+    def sampleStack(self, imgs):
+        """
+        Return the average value of every rect in every image of a
+        stack of same sized images.
+
+        @param  imgs    array in shape (N, height, width)
+        @return         float64 array in shape (N, len(self))
+        """
+        h, w = imgs.shape[1], imgs.shape[2]
+        x0 = np.clip(self.locXs, 0, h)
+        x1 = np.clip(self.locXs + self.size, 0, h)
+        y0 = np.clip(self.locYs, 0, w)
+        y1 = np.clip(self.locYs + self.size, 0, w)
+        area = (x1 - x0) * (y1 - y0)
+
+        if len(self) * self.size ** 2 * 4 < h * w:
+            offsets = np.arange(self.size)
+            rows = x0[:, np.newaxis] + offsets
+            cols = y0[:, np.newaxis] + offsets
+            # Rects clipped at 0 end at x1/y1, before size steps
+            mask = ((rows < x1[:, np.newaxis])[:, :, np.newaxis] &
+                (cols < y1[:, np.newaxis])[:, np.newaxis, :])
+            patches = imgs[:, np.minimum(rows, h - 1)[:, :, np.newaxis],
+                np.minimum(cols, w - 1)[:, np.newaxis, :]]
+            sums = np.where(mask, patches, 0).sum(axis=(2, 3))
+        else:
+            # Integral images of the whole stack, padded with a zero
+            # row and col like cv2.integral
+            integral = np.zeros((len(imgs), h + 1, w + 1), np.float64)
+            np.cumsum(imgs, axis=1, out=integral[:, 1:, 1:])
+            np.cumsum(integral[:, 1:, 1:], axis=2, out=integral[:, 1:, 1:])
+            sums = (integral[:, x1, y1] - integral[:, x0, y1]
+                - integral[:, x1, y0] + integral[:, x0, y0])
+        return np.where(area > 0, sums / np.maximum(area, 1), 0.0)
+
+    def _gatherSums(self, img, x0, x1, y0, y1, area):
+        """
+        Sum the clipped rects [x0:x1, y0:y1] by gathering their pixels
+        with fancy indexing.
+        """
+        h, w = img.shape[0], img.shape[1]
+        offsets = np.arange(self.size)
+        rows = x0[:, np.newaxis] + offsets
+        cols = y0[:, np.newaxis] + offsets
+        mask = ((rows < x1[:, np.newaxis])[:, :, np.newaxis] &
+            (cols < y1[:, np.newaxis])[:, np.newaxis, :])
+        patches = img[np.minimum(rows, h - 1)[:, :, np.newaxis],
+            np.minimum(cols, w - 1)[:, np.newaxis, :]]
+        sums = np.where(mask, patches, 0).sum(axis=(1, 2))
+        return np.float64(np.where(area > 0, sums, 0))
+
+class RoiStatistics(object):
+    """
+    Mean and entropy of a rect of an image, cheap to update while the
+    rect is dragged.
+
+    The mean comes from the integral image in O(1). The histogram of the
+    last rect is kept, and the histogram of the next one is made by
+    removing the pixels which left the rect and adding the new ones, so
+    an update costs the changed area, not the area of the rect.
+    """
+
+    def __init__(self, img):
+        """
+        @param  img     uint8 gray image, the integral image is made once
+        """
+        if img.ndim == 3:
+            img = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+        self.img = img
+        self.integral = cv2.integral(img, sdepth=cv2.CV_64F)
+        self.rect = None
+        self.histogram = None
+
+    def clip(self, rect):
+        h, w = self.img.shape
+        minX, minY, maxX, maxY = rect
+        minX, maxX = min(max(minX, 0), w), min(max(maxX, 0), w)
+        minY, maxY = min(max(minY, 0), h), min(max(maxY, 0), h)
+        return minX, minY, max(maxX, minX), max(maxY, minY)
+
+    def getMean(self, rect):
+        """
+        Return the mean of img[minY:maxY, minX:maxX], 0 for an empty rect.
+
+        @param  rect    (minX, minY, maxX, maxY) as SingleImageProcess.sel
+        """
+        minX, minY, maxX, maxY = self.clip(rect)
+        area = (maxX - minX) * (maxY - minY)
+        if area == 0:
+            return 0.0
+        ii = self.integral
+        return (ii[maxY, maxX] - ii[minY, maxX] - ii[maxY, minX]
+            + ii[minY, minX]) / area
+
+    def getHistogram(self, rect):
+        """
+        Return the 256 bins histogram of the rect.
+        """
+        rect = self.clip(rect)
+        if self.rect is not None:
+            removed = subtractRect(self.rect, rect)
+            added = subtractRect(rect, self.rect)
+            if getArea(removed) + getArea(added) < getArea([rect]):
+                for part in removed:
+                    self.histogram -= self.getPartHistogram(part)
+                for part in added:
+                    self.histogram += self.getPartHistogram(part)
+                self.rect = rect
+                return self.histogram
+        self.histogram = self.getPartHistogram(rect)
+        self.rect = rect
+        return self.histogram
+
+    def getPartHistogram(self, rect):
+        minX, minY, maxX, maxY = rect
+        return np.bincount(self.img[minY:maxY, minX:maxX].ravel(),
+            minlength=256)
+
+    def getEntropy(self, rect):
+        """
+        Return the shannon entropy (in bits) of the rect, 0 when empty.
+        """
+        histogram = self.getHistogram(rect)
+        if not histogram.any():
+            return 0.0
+        return float(imageStats.getEntropy(histogram))
+
+def getArea(rects):
+    return sum((maxX - minX) * (maxY - minY)
+        for minX, minY, maxX, maxY in rects)
+
+def subtractRect(a, b):
+    """
+    Return the rects (at most 4) covering a but not b, rects are
+    (minX, minY, maxX, maxY).
+    """
+    aMinX, aMinY, aMaxX, aMaxY = a
+    bMinX, bMinY, bMaxX, bMaxY = b
+    if bMinX >= aMaxX or bMaxX <= aMinX or bMinY >= aMaxY or bMaxY <= aMinY:
+        return [a] if getArea([a]) else []
+    parts = [
+        # rows above and below b
+        (aMinX, aMinY, aMaxX, bMinY),
+        (aMinX, bMaxY, aMaxX, aMaxY),
+        # left and right of b, within its rows
+        (aMinX, max(aMinY, bMinY), bMinX, min(aMaxY, bMaxY)),
+        (bMaxX, max(aMinY, bMinY), aMaxX, min(aMaxY, bMaxY))]
+    return [part for part in parts if part[2] > part[0] and part[3] > part[1]]
@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015-2016, Xuyang Hu <xuyanghu@yahoo.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License version 2.1
+# as published by the Free Software Foundation
+
+"""
+imageStack reads frames from a memory mapped stack file.
+
+A stack is a .npy file of shape (count, height, width), or a raw file
+of frames stored one after the other. The layout of a raw file is given
+to ImageStack or read from a json file next to it, <file>.json:
+
+    {"shape": [480, 640], "dtype": "uint16", "offset": 0, "maxValue": 4095}
+
+Nothing is decoded: frames are views of the mapped file, read by the OS
+when they are used. The frame count of a raw file follows its size, so
+a file still being written by the camera can be read again with
+refresh().
+"""
+
+import json
+import os
+
+import cv2
+import numpy as np
+
+# pylint: disable=C0103,R0904,W0102,W0201
+
+stackSuffixes = ('.npy', '.raw', '.bin')
+
+def isStackFile(path):
+    """
+    Return True if path looks like a stack file.
+    """
+    return os.path.isfile(path) and \
+        os.path.splitext(path)[1].lower() in stackSuffixes
+
+class ImageStack(object):
+    """
+    A memory mapped stack of gray frames.
+
+    uint8 frames are returned as zero-copy views. Frames of other types
+    are scaled to uint8 by 255 / maxValue (the dtype maximum by default)
+    since the filter and the metrics work on 8 bits images.
+
+    Only the file name and the layout are pickled, the worker processes
+    map the file again.
+    """
+
+    def __init__(self, path, shape=None, dtype=None, offset=0,
+            maxValue=None):
+        """
+        @param  shape   (height, width) of a frame of a raw file, read
+                        from <path>.json when not given
+        @param  dtype   numpy type of the raw pixels (default uint8)
+        @param  offset  bytes before the first frame of a raw file
+        """
+        self.path = path
+        if not path.lower().endswith('.npy'):
+            metaPath = path + '.json'
+            if shape is None and os.path.isfile(metaPath):
+                with open(metaPath) as f:
+                    meta = json.load(f)
+                shape = meta['shape']
+                dtype = meta.get('dtype', dtype)
+                offset = meta.get('offset', offset)
+                maxValue = meta.get('maxValue', maxValue)
+            if shape is None:
+                raise ValueError("The frame shape of %s is unknown, give it "
+                    "or describe it in %s" % (path, metaPath))
+            shape = tuple(int(v) for v in shape[-2:])
+        self.frameShape = shape
+        self.dtype = np.dtype(dtype or np.uint8)
+        self.offset = offset
+        self.maxValue = maxValue
+        self.refresh()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['frames']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.refresh()
+
+    def refresh(self):
+        """
+        Map the file again, e.g. after frames were appended to it.
+
+        @return     number of frames
+        """
+        if self.path.lower().endswith('.npy'):
+            self.frames = np.load(self.path, mmap_mode='r')
+            if self.frames.ndim == 2:
+                self.frames = self.frames[np.newaxis]
+            self.frameShape = self.frames.shape[1:3]
+            self.dtype = self.frames.dtype
+        else:
+            frameBytes = self.frameShape[0] * self.frameShape[1] * \
+                self.dtype.itemsize
+            count = (os.path.getsize(self.path) - self.offset) // frameBytes
+            if count > 0:
+                self.frames = np.memmap(self.path, self.dtype, 'r',
+                    self.offset, (count,) + self.frameShape)
+            else:
+                self.frames = np.empty((0,) + self.frameShape, self.dtype)
+        return len(self.frames)
+
+    def __len__(self):
+        return len(self.frames)
+
+    def getFrameName(self, index):
+        return '%s:%05d' % (os.path.basename(self.path), index)
+
+    def getFrame(self, index, roi=None):
+        """
+        Return the frame as an uint8 image.
+
+        @param  roi     (minX, minY, maxX, maxY) or None for the full frame
+        """
+        frame = self.frames[index]
+        if roi:
+            frame = frame[roi[1]:roi[3], roi[0]:roi[2]]
+        if frame.dtype == np.uint8:
+            return frame
+        maxValue = self.maxValue
+        if maxValue is None:
+            maxValue = np.iinfo(frame.dtype).max \
+                if frame.dtype.kind in 'ui' else 1.0
+        return cv2.convertScaleAbs(np.asarray(frame), alpha=255.0 / maxValue)
@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015-2016, Xuyang Hu <xuyanghu@yahoo.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License version 2.1
+# as published by the Free Software Foundation
+
+"""
+imageStats computes gray level statistics from histograms.
+
+Every statistic is derived from the 256 bins histogram of an uint8 image,
+so an image is only scanned once. The functions accept one histogram
+(256,) or a stack of histograms (n, 256) and then return one value per
+image, which lets a whole folder be summarized in a single call.
+"""
+
+import numpy as np
+
+# pylint: disable=C0103,R0904,W0102,W0201
+
+LEVELS = np.arange(256, dtype=np.float64)
+
+def getHistograms(imgs):
+    """
+    Return the gray level histograms of uint8 images.
+
+    @param  imgs    one image (h, w), or a stack (n, h, w) / list of images
+    @return         int64 array in shape (256,) or (n, 256)
+    """
+    if isinstance(imgs, np.ndarray) and imgs.ndim == 2:
+        return np.bincount(imgs.ravel(), minlength=256)
+    if isinstance(imgs, np.ndarray) and imgs.ndim == 3:
+        # One bincount for the whole stack, frame i counts in bins 256*i+
+        count = len(imgs)
+        offsets = np.arange(count, dtype=np.intp)[:, np.newaxis] * 256
+        bins = imgs.reshape(count, -1) + offsets
+        return np.bincount(bins.ravel(), minlength=256 * count).reshape(
+            count, 256)
+    return np.array([np.bincount(img.ravel(), minlength=256)
+        for img in imgs]).reshape(-1, 256)
+
+def getCounts(histograms):
+    return histograms.sum(axis=-1)
+
+def getMean(histograms):
+    return np.dot(histograms, LEVELS) / getCounts(histograms)
+
+def getStd(histograms):
+    counts = getCounts(histograms)
+    mean = np.dot(histograms, LEVELS) / counts
+    var = np.dot(histograms, LEVELS ** 2) / counts - mean ** 2
+    return np.sqrt(np.maximum(var, 0))
+
+def getMin(histograms):
+    return np.argmax(histograms > 0, axis=-1)
+
+def getMax(histograms):
+    return 255 - np.argmax(histograms[..., ::-1] > 0, axis=-1)
+
+def getPercentiles(histograms, percentiles):
+    """
+    Return the gray level below which the given percents of pixels are.
+
+    @param  percentiles     sequence of percents in [0, 100]
+    @return                 array in shape (len(percentiles),) or
+                            (n, len(percentiles))
+    """
+    cdf = np.cumsum(histograms, axis=-1)
+    counts = cdf[..., -1:]
+    result = [np.argmax(cdf >= counts * (q / 100.0), axis=-1)
+        for q in percentiles]
+    return np.array(result).T
+
+def getEntropy(histograms):
+    """
+    Return the shannon entropy (in bits) of the histograms.
+    """
+    p = histograms / getCounts(histograms)[..., np.newaxis].astype(np.float64)
+    logp = np.log2(np.where(p > 0, p, 1))
+    return -np.sum(p * logp, axis=-1)
+
+def getStatistics(histograms, percentiles=()):
+    """
+    Return all the statistics of the histograms in a dict.
+
+    Keys are 'mean', 'std', 'min', 'max', 'entropy' and, when percentiles
+    are asked, 'percentiles'.
+    """
+    stats = {
+        'mean': getMean(histograms),
+        'std': getStd(histograms),
+        'min': getMin(histograms),
+        'max': getMax(histograms),
+        'entropy': getEntropy(histograms)}
+    if percentiles:
+        stats['percentiles'] = getPercentiles(histograms, percentiles)
+    return stats
@@ -0,0 +1,389 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015-2016, Xuyang Hu <xuyanghu@yahoo.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License version 2.1
+# as published by the Free Software Foundation
+
+"""
+imageViewer shows numpy images inside the Qt window, with zoom and pan.
+
+The uint8 arrays are wrapped as QImage without copying them, and a
+pyramid of half sized copies is built when the view is zoomed out, so
+a paint only scales the visible part of the level nearest to the screen
+resolution, whatever the size of the frame.
+
+Mouse:  wheel zooms around the cursor, right or middle drag pans,
+        double click fits the image to the view, left drag is sent to
+        the mouse callback (e.g. a ROI selection, see setSelection).
+Keys:   + and - zoom, 0 fits the image to the view.
+"""
+
+import math
+
+import cv2
+import numpy as np
+from PySide import QtGui, QtCore
+
+# pylint: disable=C0103,R0904,W0102,W0201
+
+grayTable = [QtGui.qRgb(i, i, i) for i in range(256)]
+
+def toDisplayable(img):
+    """
+    Return img as an uint8 gray or RGB array QImage can wrap: other
+    types are scaled to 0-255 and BGR is swapped, which makes a copy.
+    """
+    if img.dtype != np.uint8:
+        img = cv2.normalize(img, None, 0, 255, cv2.NORM_MINMAX, cv2.CV_8U)
+    if img.ndim == 3:
+        if img.shape[2] == 1:
+            img = img[:, :, 0]
+        else:
+            img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+    # e.g. a ROI view of a larger image
+    if not img.flags.c_contiguous:
+        img = np.ascontiguousarray(img)
+    return img
+
+def toQImage(img):
+    """
+    Wrap a contiguous uint8 gray or RGB array as a QImage sharing its
+    memory, see toDisplayable. The array must outlive the QImage.
+    """
+    if img.ndim == 2:
+        image = QtGui.QImage(img.data, img.shape[1], img.shape[0],
+            img.strides[0], QtGui.QImage.Format_Indexed8)
+        image.setColorTable(grayTable)
+    else:
+        image = QtGui.QImage(img.data, img.shape[1], img.shape[0],
+            img.strides[0], QtGui.QImage.Format_RGB888)
+    return image
+
+class ImagePyramid(object):
+    """
+    An image and its half, quarter... sized copies, made on demand.
+
+    Each level keeps its array and the QImage wrapping it.
+    """
+
+    def __init__(self, img, minSize=64):
+        """
+        @param  minSize     no level is made smaller than this
+        """
+        img = toDisplayable(img)
+        self.arrays = [img]
+        self.images = [toQImage(img)]
+        self.levelCount = 1 + max(int(math.log(max(max(img.shape[:2]), 1)
+            / float(minSize), 2)), 0)
+
+    def getShape(self):
+        return self.arrays[0].shape[:2]
+
+    def getLevelFor(self, scale):
+        """
+        Return the level to draw at scale (displayed / image pixels):
+        the smallest one which still has one pixel per screen pixel.
+        """
+        if scale >= 1:
+            return 0
+        return min(int(math.log(1.0 / scale, 2)), self.levelCount - 1)
+
+    def getImage(self, level):
+        """
+        Return the QImage of level, making the missing levels.
+        """
+        while len(self.arrays) <= level:
+            last = self.arrays[-1]
+            img = cv2.resize(last, ((last.shape[1] + 1) // 2,
+                (last.shape[0] + 1) // 2), interpolation=cv2.INTER_AREA)
+            self.arrays.append(img)
+            self.images.append(toQImage(img))
+        return self.images[level]
+
+class ImageViewer(QtGui.QWidget):
+    """
+    Zoomable and pannable view of one image.
+
+    setMouseCallback takes a function like the one of
+    cv2.setMouseCallback, called with the left button events in image
+    coordinates. setKeyCallback takes a function called with the keys
+    the view does not use, as codes of cv2.waitKey.
+
+    Mouse moves are sent to the callback at most once per display
+    refresh, the last one wins. A selection rect is drawn over the
+    image by the view itself, so moving it only repaints its outline.
+    """
+
+    maxScale = 32.0
+    # ms between two mouse moves sent to the callback, Qt 4 does not
+    # tell the display refresh rate so 60 Hz is assumed
+    refreshInterval = 16
+    selectionColor = QtGui.QColor(255, 255, 0)
+
+    def __init__(self, parent=None):
+        super(ImageViewer, self).__init__(parent)
+        self.pyramid = None
+        # Displayed pixels per image pixel, and the widget position of
+        # the image origin
+        self.scale = 1.0
+        self.offset = QtCore.QPointF(0, 0)
+        self.isFitted = True
+        self.panStart = None
+        self.mouseCallback = None
+        self.keyCallback = None
+        # (minX, minY, maxX, maxY) in image pixels and its label
+        self.selection = None
+        self.selectionLabel = None
+        # Last mouse move not sent to the callback yet
+        self.pendingMove = None
+        self.moveTimer = QtCore.QTimer(self)
+        self.moveTimer.setSingleShot(True)
+        self.moveTimer.setInterval(self.refreshInterval)
+        self.moveTimer.timeout.connect(self.sendPendingMove)
+        self.setFocusPolicy(QtCore.Qt.StrongFocus)
+        self.setMinimumSize(64, 64)
+
+    def setImage(self, img, keepView=False):
+        """
+        Show img (gray, BGR, or any type scaled to 0-255).
+
+        @param  keepView    keep the zoom and the position, e.g. when img
+                            is a processed version of the shown image
+        """
+        oldShape = self.pyramid.getShape() if self.pyramid else None
+        self.pyramid = ImagePyramid(img)
+        self.selection = None
+        if not keepView or oldShape != self.pyramid.getShape():
+            self.fitToWindow()
+        self.update()
+
+    def setMouseCallback(self, callback):
+        """
+        @param  callback    callback(event, x, y, flags, param) with the
+                            cv2.EVENT_* and cv2.EVENT_FLAG_* constants
+        """
+        self.mouseCallback = callback
+
+    def setKeyCallback(self, callback):
+        """
+        @param  callback    callback(key), key is e.g. 27 for Esc
+        """
+        self.keyCallback = callback
+
+    def setSelection(self, selection, label=None):
+        """
+        Draw the rect selection (minX, minY, maxX, maxY) over the image,
+        with label above it, or remove it when selection is None.
+
+        Only the outlines (and labels) of the old and new selections
+        are repainted.
+        """
+        damaged = self.getSelectionRegion()
+        self.selection = selection
+        self.selectionLabel = label
+        self.update(damaged.united(self.getSelectionRegion()))
+
+    def getSelectionRect(self):
+        """
+        Return the selection in widget coordinates, outline included.
+        """
+        minX, minY, maxX, maxY = self.selection
+        return QtCore.QRectF(self.mapFromImage(minX, minY),
+            self.mapFromImage(maxX, maxY)).toAlignedRect()
+
+    def getLabelRect(self):
+        metrics = self.fontMetrics()
+        rect = self.getSelectionRect()
+        size = QtCore.QSize(metrics.width(self.selectionLabel) + 8,
+            metrics.height() + 4)
+        if rect.top() - size.height() - 2 >= 0:
+            return QtCore.QRect(QtCore.QPoint(rect.left(),
+                rect.top() - size.height() - 2), size)
+        return QtCore.QRect(QtCore.QPoint(rect.left(), rect.bottom() + 3),
+            size)
+
+    def getSelectionRegion(self):
+        """
+        Return the region covered by the selection outline and label.
+        """
+        region = QtGui.QRegion()
+        if self.selection is None:
+            return region
+        rect = self.getSelectionRect()
+        region = QtGui.QRegion(rect.adjusted(-2, -2, 2, 2))
+        inner = rect.adjusted(2, 2, -2, -2)
+        if inner.isValid():
+            region = region.subtracted(QtGui.QRegion(inner))
+        if self.selectionLabel:
+            region = region.united(QtGui.QRegion(self.getLabelRect()))
+        return region
+
+    def fitToWindow(self):
+        self.isFitted = True
+        if self.pyramid is None:
+            return
+        h, w = self.pyramid.getShape()
+        self.scale = min(self.width() / float(w), self.height() / float(h))
+        self.offset = QtCore.QPointF((self.width() - w * self.scale) / 2,
+            (self.height() - h * self.scale) / 2)
+        self.update()
+
+    def zoom(self, factor, center=None):
+        """
+        Zoom by factor keeping the image point under center in place.
+        """
+        if self.pyramid is None:
+            return
+        if center is None:
+            center = QtCore.QPointF(self.width() / 2.0, self.height() / 2.0)
+        h, w = self.pyramid.getShape()
+        minScale = min(1.0, 0.5 * min(self.width() / float(w),
+            self.height() / float(h)))
+        scale = max(min(self.scale * factor, self.maxScale), minScale)
+        self.offset = center - (center - self.offset) * (scale / self.scale)
+        self.scale = scale
+        self.isFitted = False
+        self.update()
+
+    def mapToImage(self, pos):
+        """
+        Return the (x, y) image pixel at the widget position pos.
+        """
+        return (int(math.floor((pos.x() - self.offset.x()) / self.scale)),
+            int(math.floor((pos.y() - self.offset.y()) / self.scale)))
+
+    def mapFromImage(self, x, y):
+        """
+        Return the widget position of the image point (x, y).
+        """
+        return QtCore.QPointF(self.offset.x() + x * self.scale,
+            self.offset.y() + y * self.scale)
+
+    def paintEvent(self, event):
+        painter = QtGui.QPainter(self)
+        # The damaged rects are painted one by one, e.g. the outlines of
+        # a moved selection, not their bounding rect
+        for rect in event.region().rects():
+            painter.fillRect(rect, self.palette().dark())
+            self.paintImage(painter, QtCore.QRectF(rect))
+        self.paintOverlay(painter)
+
+    def paintImage(self, painter, rect):
+        """
+        Draw the part of the image under rect (widget coordinates).
+        """
+        if self.pyramid is None:
+            return
+        h, w = self.pyramid.getShape()
+        left = max((rect.left() - self.offset.x()) / self.scale, 0)
+        top = max((rect.top() - self.offset.y()) / self.scale, 0)
+        right = min((rect.right() - self.offset.x()) / self.scale, w)
+        bottom = min((rect.bottom() - self.offset.y()) / self.scale, h)
+        if right <= left or bottom <= top:
+            return
+        level = self.pyramid.getLevelFor(self.scale)
+        image = self.pyramid.getImage(level)
+        levelScale = float(image.width()) / w
+        source = QtCore.QRectF(left * levelScale, top * levelScale,
+            (right - left) * levelScale, (bottom - top) * levelScale)
+        target = QtCore.QRectF(self.mapFromImage(left, top),
+            self.mapFromImage(right, bottom))
+        # Pixels are shown as squares when zoomed in
+        painter.setRenderHint(QtGui.QPainter.SmoothPixmapTransform,
+            self.scale < 1)
+        painter.drawImage(target, image, source)
+
+    def paintOverlay(self, painter):
+        """
+        Draw over the image, in widget coordinates.
+        """
+        if self.selection is None or self.pyramid is None:
+            return
+        pen = QtGui.QPen(self.selectionColor)
+        pen.setCosmetic(True)
+        painter.setPen(pen)
+        painter.setBrush(QtCore.Qt.NoBrush)
+        rect = self.getSelectionRect()
+        painter.drawRect(rect.adjusted(0, 0, -1, -1))
+        if self.selectionLabel:
+            labelRect = self.getLabelRect()
+            painter.fillRect(labelRect, QtGui.QColor(0, 0, 0, 160))
+            painter.drawText(labelRect, QtCore.Qt.AlignCenter,
+                self.selectionLabel)
+
+    def resizeEvent(self, event):
+        if self.isFitted:
+            self.fitToWindow()
+
+    def wheelEvent(self, event):
+        # One wheel step (120) zooms by 2^(1/4)
+        self.zoom(math.pow(2, event.delta() / 480.0),
+            QtCore.QPointF(event.pos()))
+
+    def mouseDoubleClickEvent(self, event):
+        self.fitToWindow()
+
+    def mousePressEvent(self, event):
+        if event.button() in (QtCore.Qt.RightButton, QtCore.Qt.MiddleButton):
+            self.panStart = QtCore.QPointF(event.pos()) - self.offset
+        elif event.button() == QtCore.Qt.LeftButton:
+            self.callMouseCallback(cv2.EVENT_LBUTTONDOWN, event.pos(),
+                event.buttons())
+
+    def mouseMoveEvent(self, event):
+        if self.panStart is not None:
+            self.offset = QtCore.QPointF(event.pos()) - self.panStart
+            self.isFitted = False
+            self.update()
+        elif event.buttons() & QtCore.Qt.LeftButton:
+            if self.moveTimer.isActive():
+                # Sent when the timer expires, with the later moves
+                self.pendingMove = (event.pos(), event.buttons())
+                return
+            self.callMouseCallback(cv2.EVENT_MOUSEMOVE, event.pos(),
+                event.buttons())
+            self.moveTimer.start()
+
+    def sendPendingMove(self):
+        if self.pendingMove is None:
+            return
+        pos, buttons = self.pendingMove
+        self.pendingMove = None
+        self.callMouseCallback(cv2.EVENT_MOUSEMOVE, pos, buttons)
+        self.moveTimer.start()
+
+    def mouseReleaseEvent(self, event):
+        if self.panStart is not None:
+            self.panStart = None
+        elif event.button() == QtCore.Qt.LeftButton:
+            self.moveTimer.stop()
+            self.sendPendingMove()
+            self.moveTimer.stop()
+            self.callMouseCallback(cv2.EVENT_LBUTTONUP, event.pos(),
+                event.buttons())
+
+    def callMouseCallback(self, cvEvent, pos, buttons):
+        if self.mouseCallback is None or self.pyramid is None:
+            return
+        flags = cv2.EVENT_FLAG_LBUTTON \
+            if buttons & QtCore.Qt.LeftButton else 0
+        x, y = self.mapToImage(pos)
+        h, w = self.pyramid.getShape()
+        self.mouseCallback(cvEvent, min(max(x, 0), w - 1),
+            min(max(y, 0), h - 1), flags, None)
+
+    def keyPressEvent(self, event):
+        key = event.key()
+        if key in (QtCore.Qt.Key_Plus, QtCore.Qt.Key_Equal):
+            self.zoom(2.0)
+        elif key == QtCore.Qt.Key_Minus:
+            self.zoom(0.5)
+        elif key == QtCore.Qt.Key_0:
+            self.fitToWindow()
+        elif event.text() and self.keyCallback is not None:
+            self.keyCallback(ord(event.text()[0]))
+        else:
+            super(ImageViewer, self).keyPressEvent(event)
@@ -21,24 +21,143 @@ pick & process in a humanly fashion instead of using big previewers.
 
 # pylint: disable=C0103,R0904,W0102,W0201
 
+import time
+launchTime = time.time()
+
+import os
 import sys
 from PySide import QtGui, QtCore
-import numpy as np
-import imageProcesser as imp
 import fileUI
+# The processing stack (cv2, numpy, matplotlib) is imported on first use
+# in the methods below, so the window shows up without waiting for it.
 
 testPath = './lena.jpeg'
+# Time (s) from launch to the window being shown that we aim for
+startupTarget = 0.3
+# Filtered images of the previous runs, see imageCache
+cacheDir = os.path.join(os.path.expanduser('~'), '.imagePicker', 'cache')
+# Watch mode rescans the folder at least this often (ms), in case the
+# file system watcher misses changes (e.g. on network shares)
+watchPollInterval = 2000
 
 class OutputViewer(QtGui.QWidget):
+    """
+    Shows the picked image and the processed ones (filtered results,
+    spectra...) inside the window, one tab per title.
+
+    Each tab is an imageViewer.ImageViewer: the numpy images are shown
+    without copying them and can be zoomed and panned.
+    """
+
     def __init__(self, parent=None):
         super(OutputViewer, self).__init__(parent)
         self.setLayout(QtGui.QHBoxLayout())
+        self.layout().setContentsMargins(0, 0, 0, 0)
 
-        self.outputwindow = QtGui.QLabel("Loading...")
-        # self.outputwindow.setFrameStyle()
+        self.outputwindow = QtGui.QLabel("No image")
+        self.outputwindow.setAlignment(QtCore.Qt.AlignCenter)
         self.layout().addWidget(self.outputwindow)
-        # TODO: implement output viewer
-        pass
+        self.tabs = None
+        self.viewers = {}
+
+    def showImage(self, title, img, keepView=False):
+        """
+        Show img in the tab title, which is made on first use.
+
+        @param  keepView    keep the zoom of the tab, see ImageViewer
+        @return             the ImageViewer of the tab
+        """
+        # imageViewer needs cv2 and numpy, see the imports above
+        from imageViewer import ImageViewer
+        if self.tabs is None:
+            self.outputwindow.hide()
+            self.tabs = QtGui.QTabWidget()
+            self.layout().addWidget(self.tabs)
+        viewer = self.viewers.get(title)
+        if viewer is None:
+            viewer = ImageViewer()
+            self.viewers[title] = viewer
+            self.tabs.addTab(viewer, title)
+        viewer.setImage(img, keepView)
+        self.tabs.setCurrentWidget(viewer)
+        return viewer
+
+class BatchWorker(QtCore.QObject):
+    """
+    Runs the metrics of a BatchProcessing in a QThread.
+
+    Move it to a QThread and connect the thread's started signal to run.
+    The results are sent back to the GUI thread through signals.
+
+    Given the batch and the results of a previous run, only the images
+    added or modified since then are processed and merged into results
+    (see BatchProcessing.updateMetrics).
+    """
+
+    # done, total, images per second, ETA in seconds (-1 if unknown)
+    progress = QtCore.Signal(int, int, float, float)
+    # {metric name: values}, see BatchProcessing.getMetrics
+    finished = QtCore.Signal(object)
+    failed = QtCore.Signal(str)
+    cancelled = QtCore.Signal()
+
+    def __init__(self, rootPath, roi, plan, cache=None, workers=1,
+            batch=None, results=None):
+        super(BatchWorker, self).__init__()
+        self.rootPath = rootPath
+        self.roi = roi
+        self.plan = plan
+        self.cache = cache
+        self.workers = workers
+        self.batch = batch
+        self.results = results
+        self.isCancelled = False
+        self.startTime = None
+
+    @QtCore.Slot()
+    def run(self):
+        """
+        Process the folder, runs in the worker thread.
+        """
+        self.startTime = time.time()
+        # Imported here so that the GUI thread does not pay for it
+        import batchProcesser
+        try:
+            if self.results is not None:
+                self.batch.progress = self.reportProgress
+                self.batch.updateMetrics(self.plan, self.results)
+                self.finished.emit(self.results)
+                return
+            self.batch = batchProcesser.BatchProcessing(rootPath=self.rootPath,
+                roi=self.roi, streaming=True, workers=self.workers,
+                cache=self.cache, progress=self.reportProgress)
+            if self.isCancelled:
+                raise batchProcesser.BatchCancelled()
+            results = self.batch.getMetrics(self.plan)
+        except batchProcesser.BatchCancelled:
+            self.cancelled.emit()
+            return
+        except Exception as e: # pylint: disable=W0703
+            self.failed.emit(str(e))
+            return
+        finally:
+            if self.batch is not None:
+                self.batch.close()
+        self.finished.emit(results)
+
+    def cancel(self):
+        """
+        Ask the run to stop, can be called from the GUI thread.
+        """
+        self.isCancelled = True
+        if self.batch is not None:
+            self.batch.cancel()
+
+    def reportProgress(self, done, total):
+        elapsed = time.time() - self.startTime
+        rate = done / elapsed if elapsed > 0 else 0.0
+        eta = (total - done) / rate if rate > 0 else -1.0
+        self.progress.emit(done, total, rate, eta)
 
 class WrapperWidget(QtGui.QMainWindow):
     """
@@ -60,12 +179,22 @@ class WrapperWidget(QtGui.QMainWindow):
         self.createWrappers()
         self.createButtons()
 
-        self.resize(640, 512)
+        self.resize(960, 600)
         self.show()
 
         self.filePath = testPath
 
         self.globalROI = None
+        self.imageCache = None
+        self.batchThread = None
+        self.batchWorker = None
+        self.batchResults = None
+        self.liveFigure = None
+        self.resultFigure = None
+        self.singleImage = None
+        self.folderWatcher = None
+        self.watchTimer = None
+        self.watchPending = False
 
     def createMenus(self):
         """
@@ -101,8 +230,7 @@ class WrapperWidget(QtGui.QMainWindow):
         print "Creating wrappers..."
         self.menu = fileUI.FolderPicker()
         self.picker = fileUI.FilePicker()
-        # TODO: write the output view inside window
-        # self.outputviewer = OutputViewer()
+        self.outputviewer = OutputViewer()
         self.menu.folderPicked.connect(self.picker.setRootPath)
         self.folderPicked.connect(self.picker.setRootPath)
         self.menu.folderSelector.activated[str].connect(self.picker.setRootPath)
@@ -112,8 +240,7 @@ class WrapperWidget(QtGui.QMainWindow):
         menuContainer.addWidget(self.menu)
         pickerContainer = QtGui.QHBoxLayout()
         pickerContainer.addWidget(self.picker)
-        # outputContainer = QtGui.QHBoxLayout()
-        # outputContainer.addWidget(self.outputviewer)
+        pickerContainer.addWidget(self.outputviewer, 1)
 
         self.centralWidget().layout().addLayout(menuContainer)
         self.centralWidget().layout().addLayout(pickerContainer)
@@ -125,15 +252,27 @@ class WrapperWidget(QtGui.QMainWindow):
         print "Creating buttons..."
         self.batchProcessButton = QtGui.QPushButton("Process All")
         self.batchProcessButton.clicked.connect(self.processAllImages)
+        self.cancelButton = QtGui.QPushButton("Cancel")
+        self.cancelButton.clicked.connect(self.cancelProcessing)
+        self.cancelButton.setDisabled(True)
+        self.watchButton = QtGui.QPushButton("Watch folder")
+        self.watchButton.setCheckable(True)
+        self.watchButton.toggled.connect(self.setWatching)
         self.setROIButton = QtGui.QPushButton("ROI for All")
         self.setROIButton.clicked.connect(self.saveGlobalROI)
 
         self.buttonContainer = QtGui.QHBoxLayout()
         self.buttonContainer.addWidget(self.batchProcessButton)    
+        self.buttonContainer.addWidget(self.cancelButton)
+        self.buttonContainer.addWidget(self.watchButton)
         self.buttonContainer.addWidget(self.setROIButton)    
 
         self.centralWidget().layout().addLayout(self.buttonContainer)
 
+        self.progressBar = QtGui.QProgressBar()
+        self.progressBar.setVisible(False)
+        self.statusBar().addPermanentWidget(self.progressBar)
+
     def chooseFolder(self):
         """
         Create a dialog to choose folder.
@@ -150,25 +289,165 @@ class WrapperWidget(QtGui.QMainWindow):
         """
         Process single image
         """
+        import imageProcesser as imp
         rawPath = repr(path)[2:-1] # make the path readable
         print "Image Path: " + rawPath
-        imp1 = imp.SingleImageProcess(rawPath)
-        imp1.simpleDemo()
+        imp1 = imp.SingleImageProcess(rawPath, viewer=self.outputviewer)
         imp1.selSignal.connect(self.setROI)
+        imp1.simpleDemo()
+        # Kept while its image is shown, it handles the keys and the mouse
+        self.singleImage = imp1
 
     def processAllImages(self):
         """
         Process all the iamges in the given folder.
+
+        The images are processed in a worker thread, the results are
+        plotted by showBatchResults when it is done.
         """
+        if self.batchThread is not None:
+            return
         rootPath = self.menu.rootPath
-        imbat = imp.BatchProcessing(rootPath=rootPath, roi=self.globalROI)
-        centerArr = imbat.getCenterPoints()
-        imbat.getPointsInACol(50, showResult=True) # Warning: take care of this number!
-        imbat.getPointsInARow(50, showResult=True)
-        imbat.getCenterPointsWithoutShift(50, showResult=True)
-        entropArr = imbat.getShannonEntropies(showResult=True)
-        avgArr = imbat.getAverageValues()
-        imp.plotGraphs([avgArr, entropArr])
+        if self.imageCache is None:
+            from imageCache import FilteredImageCache
+            self.imageCache = FilteredImageCache(cacheDir)
+        # All the metrics are computed in a single pass over the images
+        plan = {
+            'col': (50,), # Warning: take care of this number!
+            'row': (50,),
+            'centerWithoutShift': (),
+            'entropy': (),
+            'average': ()}
+
+        self.batchResults = None
+        self.startBatchWorker(BatchWorker(rootPath, self.globalROI, plan,
+            cache=self.imageCache))
+        self.statusBar().showMessage("Processing " + rootPath)
+
+    def startBatchWorker(self, worker):
+        """
+        Run worker in a new QThread, results go to showBatchResults.
+        """
+        self.batchThread = QtCore.QThread(self)
+        self.batchWorker = worker
+        self.batchWorker.moveToThread(self.batchThread)
+        self.batchThread.started.connect(self.batchWorker.run)
+        self.batchWorker.progress.connect(self.showBatchProgress)
+        self.batchWorker.finished.connect(self.showBatchResults)
+        self.batchWorker.failed.connect(self.showBatchError)
+        self.batchWorker.cancelled.connect(self.onBatchCancelled)
+        for signal in (self.batchWorker.finished, self.batchWorker.failed,
+                self.batchWorker.cancelled):
+            signal.connect(self.batchThread.quit)
+        self.batchThread.finished.connect(self.onBatchThreadFinished)
+
+        self.batchProcessButton.setDisabled(True)
+        self.cancelButton.setDisabled(False)
+        self.progressBar.setValue(0)
+        self.progressBar.setVisible(True)
+        self.batchThread.start()
+
+    @QtCore.Slot(bool)
+    def setWatching(self, isWatching):
+        """
+        Starts or stops following the folder of the last "Process All".
+
+        New and modified images are processed as they arrive and the
+        live figure is updated, without running the whole folder again.
+        """
+        if not isWatching:
+            if self.folderWatcher is not None:
+                self.folderWatcher.deleteLater()
+                self.watchTimer.stop()
+                self.watchTimer.deleteLater()
+            self.folderWatcher = None
+            self.watchTimer = None
+            return
+
+        if self.batchResults is None:
+            self.processAllImages()
+        self.folderWatcher = QtCore.QFileSystemWatcher([self.menu.rootPath],
+            self)
+        self.folderWatcher.directoryChanged.connect(self.updateWatchedFolder)
+        self.watchTimer = QtCore.QTimer(self)
+        self.watchTimer.timeout.connect(self.updateWatchedFolder)
+        self.watchTimer.start(watchPollInterval)
+
+    @QtCore.Slot()
+    def updateWatchedFolder(self):
+        """
+        Processes the images that arrived in the watched folder.
+        """
+        if self.batchThread is not None:
+            # Checked again when the running batch is done
+            self.watchPending = True
+            return
+        if self.batchResults is None:
+            return
+        batch = self.batchWorker.batch
+        self.startBatchWorker(BatchWorker(batch.rootPath, batch.globalROI,
+            self.batchWorker.plan, cache=self.imageCache, batch=batch,
+            results=self.batchResults))
+
+    def cancelProcessing(self):
+        """
+        Cancel the running "Process All".
+        """
+        if self.batchWorker is not None:
+            self.batchWorker.cancel()
+            self.statusBar().showMessage("Cancelling...")
+
+    @QtCore.Slot(int, int, float, float)
+    def showBatchProgress(self, done, total, rate, eta):
+        self.progressBar.setMaximum(total)
+        self.progressBar.setValue(done)
+        message = "%d/%d images, %.1f images/s" % (done, total, rate)
+        if eta >= 0:
+            message += ", ETA %d:%02d" % (eta // 60, eta % 60)
+        self.statusBar().showMessage(message)
+
+    @QtCore.Slot(object)
+    def showBatchResults(self, results):
+        """
+        Plot the results of "Process All", runs in the GUI thread.
+        """
+        import batchProcesser
+        imbat = self.batchWorker.batch
+        self.statusBar().showMessage("Done: %d images" %
+            len(results['average']))
+        self.batchResults = results
+        if self.watchButton.isChecked():
+            names = ('centerWithoutShift', 'entropy', 'average')
+            if self.liveFigure is None or not self.liveFigure.isOpen():
+                from resultPlotter import LiveMetricsFigure
+                self.liveFigure = LiveMetricsFigure(names,
+                    batchProcesser.metricTitles)
+            self.liveFigure.update(results)
+            return
+
+        print "Cache: " + str(imbat.getCacheStats())
+        # All the metrics in one figure which does not block the UI
+        self.resultFigure = imbat.showMetrics(self.batchWorker.plan, results,
+            block=False)
+
+    @QtCore.Slot(str)
+    def showBatchError(self, message):
+        self.statusBar().showMessage("Error: " + message)
+
+    @QtCore.Slot()
+    def onBatchCancelled(self):
+        self.statusBar().showMessage("Cancelled")
+
+    @QtCore.Slot()
+    def onBatchThreadFinished(self):
+        self.batchProcessButton.setDisabled(False)
+        self.cancelButton.setDisabled(True)
+        self.progressBar.setVisible(False)
+        self.batchThread.deleteLater()
+        self.batchThread = None
+        if self.watchPending:
+            self.watchPending = False
+            self.updateWatchedFolder()
 
     def saveGlobalROI(self):
         """
@@ -203,7 +482,14 @@ def main(argv=sys.argv):
 
     _app = QtGui.QApplication(argv)
     _win = WrapperWidget()  # pylint: disable=W0612
+    # Runs once the event loop has shown the window
+    QtCore.QTimer.singleShot(0, reportStartupTime)
     return _app.exec_()
 
+def reportStartupTime():
+    elapsed = time.time() - launchTime
+    print "Window shown in %d ms (target %d ms)" % (elapsed * 1000,
+        startupTarget * 1000)
+
 if __name__ == '__main__':
     main()
@@ -0,0 +1,205 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015-2016, Xuyang Hu <xuyanghu@yahoo.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License version 2.1
+# as published by the Free Software Foundation
+
+"""
+metricResults keeps the metrics of a batch in numpy columns.
+
+Each metric is one preallocated array of shape (images,) + value shape,
+e.g. (images, pointCount) for 'col' or (images, 256) for 'histogram',
+so a run over 100k frames stores numbers, not 100k lists of Python
+floats. The rows are indexed by the file names and their timestamps.
+
+The columns can be saved as .npy files and loaded back memory mapped:
+
+    results.save('run/folder')      # folder_files.txt, folder_center.npy...
+    results = MetricResults.load('run/folder')
+"""
+
+import os
+
+import numpy as np
+
+# pylint: disable=C0103,R0904,W0102,W0201
+
+class MetricResults(object):
+    """
+    Metric columns of a growing list of images.
+
+    Rows are appended while the images are measured, the arrays grow by
+    doubling so appending stays cheap. Rows of a metric which was not
+    measured for an image are NaN (0 for integer metrics).
+
+    results['center'] is a view of the filled rows, it is not copied
+    but it may be left behind by a later append which grows the arrays.
+    """
+
+    def __init__(self, capacity=1024):
+        self.count = 0
+        self.capacity = capacity
+        self.columns = {}
+        self.fileNames = []
+        self.timestamps = np.empty(capacity)
+
+    def __len__(self):
+        return self.count
+
+    def __contains__(self, name):
+        return name in self.columns
+
+    def __getitem__(self, name):
+        return self.columns[name][:self.count]
+
+    def getNames(self):
+        return sorted(self.columns)
+
+    def reserve(self, count):
+        """
+        Make room for count rows.
+        """
+        if count <= self.capacity:
+            return
+        capacity = max(count, 2 * self.capacity)
+        for name, column in self.columns.items():
+            self.columns[name] = resizeRows(column, self.count, capacity)
+        self.timestamps = resizeRows(self.timestamps, self.count, capacity)
+        self.capacity = capacity
+
+    def addColumn(self, name, value):
+        """
+        Allocate the column of name for values like value.
+        """
+        value = np.asarray(value)
+        dtype = value.dtype if value.dtype.kind in 'uif' else np.float64
+        column = np.empty((self.capacity,) + value.shape, dtype)
+        column[:self.count] = getFillValue(column.dtype)
+        self.columns[name] = column
+        return column
+
+    def setRow(self, index, values, fileName=None, timestamp=np.nan):
+        """
+        Set the metrics {metric name: value} of the image index, index
+        can be len(self) to append a row.
+        """
+        if index >= self.count:
+            self.reserve(index + 1)
+            for column in self.columns.values():
+                # The metrics measured for other images only
+                column[self.count:index + 1] = getFillValue(column.dtype)
+            self.fileNames.extend([None] * (index + 1 - self.count))
+            self.timestamps[self.count:index + 1] = np.nan
+            self.count = index + 1
+        for name, value in values.items():
+            column = self.columns.get(name)
+            if column is None:
+                column = self.addColumn(name, value)
+            column[index] = value
+        if fileName is not None:
+            self.fileNames[index] = fileName
+        self.timestamps[index] = timestamp
+
+    def append(self, values, fileName=None, timestamp=np.nan):
+        self.setRow(self.count, values, fileName, timestamp)
+
+    def merge(self, other, indices=None, names={}):
+        """
+        Put the row i of other at the row indices[i], by default at the
+        same row. Rows past the end are appended.
+
+        @param  names   {metric name in other: column name in self}, the
+                        metrics not given keep their name
+        """
+        if indices is None:
+            indices = range(len(other))
+        indices = list(indices)
+        if indices:
+            self.reserve(max(indices) + 1)
+        for i, index in enumerate(indices):
+            self.setRow(index, {}, other.fileNames[i], other.timestamps[i])
+        for name in other.getNames():
+            column = self.columns.get(names.get(name, name))
+            values = other[name]
+            if column is None or column.shape[1:] != values.shape[1:]:
+                # A new metric, or values of another shape which replace
+                # the old ones
+                column = self.addColumn(names.get(name, name),
+                    other.columns[name][0])
+            column[indices] = values
+
+    def getRange(self, start, stop):
+        """
+        Return the rows start to stop as a MetricResults sharing the
+        arrays of this one.
+        """
+        start, stop, step = slice(start, stop).indices(self.count)
+        results = MetricResults(0)
+        results.count = results.capacity = max(stop - start, 0)
+        results.columns = dict((name, column[start:stop])
+            for name, column in self.columns.items())
+        results.fileNames = self.fileNames[start:stop]
+        results.timestamps = self.timestamps[start:stop]
+        return results
+
+    def save(self, prefix):
+        """
+        Write <prefix>_files.txt, <prefix>_timestamps.npy and one
+        <prefix>_<metric name>.npy per metric, with one row per image.
+
+        @return     list of the written files
+        """
+        paths = [prefix + '_files.txt']
+        with open(paths[0], 'w') as f:
+            f.write(''.join('%s\n' % (fileName or '')
+                for fileName in self.fileNames))
+        paths.append(prefix + '_timestamps.npy')
+        np.save(paths[-1], self.timestamps[:self.count])
+        for name in self.getNames():
+            paths.append('%s_%s.npy' % (prefix, name))
+            np.save(paths[-1], self[name])
+        return paths
+
+    @classmethod
+    def load(cls, prefix, mmapMode='r'):
+        """
+        Read the results written by save, the columns are memory mapped
+        unless mmapMode is None (np.load mmap_mode).
+        """
+        with open(prefix + '_files.txt') as f:
+            fileNames = f.read().splitlines()
+        results = cls(0)
+        results.count = results.capacity = len(fileNames)
+        results.fileNames = fileNames
+        folder, base = os.path.split(prefix)
+        for fileName in sorted(os.listdir(folder or '.')):
+            name = fileName[len(base) + 1:-4]
+            # Metric names have no '_', which skips the files of other
+            # prefixes such as <prefix>_2_center.npy
+            if not fileName.startswith(base + '_') or \
+                    not fileName.endswith('.npy') or '_' in name:
+                continue
+            column = np.load(os.path.join(folder, fileName),
+                mmap_mode=mmapMode)
+            if name == 'timestamps':
+                results.timestamps = column
+            else:
+                results.columns[name] = column
+        if len(results.timestamps) != results.count:
+            results.timestamps = np.empty(results.count)
+            results.timestamps[:] = np.nan
+        return results
+
+def getFillValue(dtype):
+    return np.nan if dtype.kind == 'f' else 0
+
+def resizeRows(column, count, capacity):
+    """
+    Return column with room for capacity rows, the first count are kept.
+    """
+    resized = np.empty((capacity,) + column.shape[1:], column.dtype)
+    resized[:count] = column[:count]
+    return resized
@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015-2016, Xuyang Hu <xuyanghu@yahoo.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License version 2.1
+# as published by the Free Software Foundation
+
+"""
+prefetcher reads the next images while the current one is processed.
+
+cv2.imread and np.load release the GIL while they read and decode, so a
+few threads keep the disk (or the network share) busy while the FFTs run
+in the main thread. Only depth images are loaded ahead of the consumer,
+so memory stays bounded when the consumer is the slow side.
+"""
+
+import collections
+from multiprocessing.pool import ThreadPool
+from timeit import default_timer
+
+# pylint: disable=C0103,R0904,W0102,W0201
+
+class Prefetcher(object):
+    """
+    Bounded, ordered prefetch of load(item) in a thread pool.
+
+    Usage:
+        prefetcher = Prefetcher(depth=4)
+        for img, seconds in prefetcher.imap(cv2.imread, paths):
+            ...
+        prefetcher.close()
+
+    getStats() tells how often the consumer had to wait (stalls) and
+    how many loaded items were waiting for it (queue depth). Many stalls
+    mean the loading is the bottleneck, a full queue means the consumer
+    is.
+    """
+
+    def __init__(self, depth=4, workers=2):
+        self.depth = depth
+        self.workers = workers
+        self._pool = None
+        self.resetStats()
+
+    def resetStats(self):
+        self.items = 0
+        self.stalls = 0
+        self.stallTime = 0.0
+        self.loadTime = 0.0
+        self.queuedTotal = 0
+        self.maxQueued = 0
+
+    def imap(self, load, items):
+        """
+        Yield (load(item), seconds spent in load) for items, in order.
+        Errors of load are raised when their item is reached.
+        """
+        if self._pool is None:
+            self._pool = ThreadPool(self.workers)
+        items = iter(items)
+        pending = collections.deque()
+
+        def submit():
+            for item in items:
+                pending.append(self._pool.apply_async(timeCall, (load, item)))
+                return
+
+        for i in range(self.depth):
+            submit()
+        while pending:
+            result = pending.popleft()
+            queued = sum(1 for r in pending if r.ready())
+            if result.ready():
+                queued += 1
+            else:
+                start = default_timer()
+                result.wait()
+                self.stalls += 1
+                self.stallTime += default_timer() - start
+            self.queuedTotal += queued
+            self.maxQueued = max(self.maxQueued, queued)
+            # Start the next one before handing this one over
+            submit()
+            value, seconds = result.get()
+            self.items += 1
+            self.loadTime += seconds
+            yield value, seconds
+
+    def close(self):
+        """
+        Stop the threads, imap starts them again when needed.
+        """
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+
+    def getStats(self):
+        """
+        Return the counters in a dict, 'meanQueued' is the average number
+        of loaded items waiting when the consumer asked for one.
+        """
+        return {
+            'depth': self.depth,
+            'workers': self.workers,
+            'items': self.items,
+            'stalls': self.stalls,
+            'stallTime': self.stallTime,
+            'loadTime': self.loadTime,
+            'meanQueued': float(self.queuedTotal) / self.items
+                if self.items else 0.0,
+            'maxQueued': self.maxQueued}
+
+    def report(self):
+        return ("Prefetch: %(items)d images, %(stalls)d stalls "
+            "(%(stallTime).3f s), load %(loadTime).3f s, queue mean "
+            "%(meanQueued).1f max %(maxQueued)d of %(depth)d"
+            % self.getStats())
+
+def timeCall(func, item):
+    start = default_timer()
+    value = func(item)
+    return value, default_timer() - start
@@ -0,0 +1,233 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015-2016, Xuyang Hu <xuyanghu@yahoo.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License version 2.1
+# as published by the Free Software Foundation
+
+"""
+resultPlotter shows batch results in figures that do not block the UI.
+
+Long series are decimated before they are drawn: each pixel column of a
+plot keeps the min and the max of its values, so spikes stay visible
+and the drawing cost depends on the plot width, not on the number of
+images.
+"""
+
+import matplotlib.pyplot as plt
+import numpy as np
+
+# pylint: disable=C0103,R0904,W0102,W0201
+
+def decimate(values, bucketCount):
+    """
+    Return (x, y) keeping the min and the max of each of bucketCount
+    buckets of values, in the order they occur, and the first and the
+    last values (the newest image in watch mode). NaN are skipped.
+
+    Series shorter than 2 * bucketCount are returned as they are.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    count = len(values)
+    if count <= 2 * bucketCount:
+        return np.arange(count), values
+    size = -(-count // bucketCount)
+    bucketCount = -(-count // size)
+    padded = np.empty(bucketCount * size)
+    padded[:count] = values
+    padded[count:] = np.nan
+    padded = padded.reshape(bucketCount, size)
+    isNan = np.isnan(padded)
+    low = np.where(isNan, np.inf, padded).argmin(axis=1)
+    high = np.where(isNan, -np.inf, padded).argmax(axis=1)
+    x = np.sort(np.column_stack([low, high]), axis=1)
+    x += np.arange(bucketCount)[:, np.newaxis] * size
+    x = np.minimum(x.ravel(), count - 1)
+    x = np.concatenate(([0], x, [count - 1]))
+    return x, values[x]
+
+def getBucketCount(ax):
+    """
+    Return the number of pixel columns of ax.
+    """
+    return max(int(ax.bbox.width), 1)
+
+class LiveMetricsFigure(object):
+    """
+    A single figure with one subplot per metric, updated in place.
+
+    The series are plotted against picture numbers. Profiles ('col' and
+    'row', pointCount values per image) are plotted against their
+    positions, as min/mean/max bands when there are many images.
+
+    Used by the watch mode: each update only changes the line data. As
+    long as the new points fit in the axes, only the lines are redrawn
+    over the saved background (blitting); the axes are grown by half
+    their size when they do not, so full redraws are rare.
+    """
+
+    maxProfiles = 50
+
+    def __init__(self, names, titles={}, profiles={}, live=True):
+        """
+        @param  names       metrics to plot, each one is a series with one
+                            value per image, or a (series x images) array
+        @param  titles      {name: (title, ylabel)}
+        @param  profiles    {name: (title, xlabel, positions)} of the
+                            profile metrics to plot
+        @param  live        show the figure now without blocking, else
+                            the caller shows it with plt.show()
+        """
+        self.names = list(names)
+        # Room left for the next images, a shown result does not grow
+        self.growth = 1.5 if live else 1.0
+        self.profiles = profiles
+        self.profileNames = sorted(profiles)
+        if live:
+            plt.ion()
+        rowCount = len(self.names) + len(self.profileNames)
+        self.figure, axes = plt.subplots(rowCount, 1, squeeze=False,
+            figsize=(8, 1 + 2.2 * rowCount))
+        self.axes = {}
+        self.lines = {}
+        for ax, name in zip(axes[:, 0], self.names + self.profileNames):
+            if name in profiles:
+                title, xlabel = profiles[name][:2]
+                ax.set_xlabel(xlabel)
+                ax.set_ylabel('Gray scale')
+            else:
+                title, ylabel = titles.get(name, (name, ''))
+                ax.set_ylabel(ylabel)
+                ax.set_xlabel('Picture numbers')
+                ax.set_xlim(0, 1)
+                self.lines[name] = []
+            ax.set_title(title)
+            self.axes[name] = ax
+        self.figure.tight_layout()
+        # Metrics whose y limits were set from their values
+        self.isScaled = set()
+        self.background = None
+        self.figure.canvas.mpl_connect('draw_event', self.onDraw)
+        if live:
+            self.figure.show()
+
+    def isOpen(self):
+        """
+        Return False once the user has closed the figure.
+        """
+        return plt.fignum_exists(self.figure.number)
+
+    def update(self, results):
+        """
+        Set the series of the metrics from results and redraw.
+        """
+        isResized = False
+        for name in self.names:
+            values = np.asarray(results[name], dtype=np.float64)
+            series = values.reshape(-1, values.shape[-1]) if values.size \
+                else np.empty((1, 0))
+            isResized |= self.setSeries(name, series)
+        for name in self.profileNames:
+            self.setProfiles(name, np.asarray(results[name]))
+            isResized = True
+
+        canvas = self.figure.canvas
+        if isResized or self.background is None or \
+                not getattr(canvas, 'supports_blit', True):
+            # onDraw saves the new background
+            canvas.draw_idle()
+            return
+        canvas.restore_region(self.background)
+        self.drawLines()
+        canvas.blit(self.figure.bbox)
+
+    def setSeries(self, name, series):
+        """
+        Set the decimated lines of a metric.
+
+        @param  series  array in shape (series, images)
+        @return         True when the axes limits changed
+        """
+        ax = self.axes[name]
+        lines = self.lines[name]
+        while len(lines) < len(series):
+            line, = ax.plot([], [], animated=True)
+            lines.append(line)
+        bucketCount = getBucketCount(ax)
+        for line, values in zip(lines, series):
+            line.set_data(*decimate(values, bucketCount))
+
+        last = series.shape[1] - 1
+        isResized = False
+        xMin, xMax = ax.get_xlim()
+        if last > xMax:
+            ax.set_xlim(0, max(last * self.growth, 1))
+            isResized = True
+        finite = series[np.isfinite(series)]
+        if finite.size:
+            yMin, yMax = ax.get_ylim()
+            low, high = finite.min(), finite.max()
+            if name not in self.isScaled or low < yMin or high > yMax:
+                self.isScaled.add(name)
+                margin = max(high - low, 1e-6) * 0.25
+                ax.set_ylim(low - margin, high + margin)
+                isResized = True
+        return isResized
+
+    def setProfiles(self, name, values):
+        """
+        Draw the profiles of a metric.
+
+        @param  values  array in shape (pointCount, images)
+        """
+        ax = self.axes[name]
+        positions = self.profiles[name][2]
+        for artist in list(ax.lines) + list(ax.collections):
+            artist.remove()
+        if values.size == 0:
+            return
+        if values.shape[1] <= self.maxProfiles:
+            ax.plot(positions, values)
+            ax.relim()
+            ax.autoscale_view()
+            return
+        low = np.nanmin(values, axis=1)
+        high = np.nanmax(values, axis=1)
+        ax.fill_between(positions, low, high, alpha=0.3)
+        ax.plot(positions, np.nanmean(values, axis=1))
+        # relim ignores the band
+        margin = max(np.nanmax(high) - np.nanmin(low), 1e-6) * 0.05
+        ax.set_xlim(positions[0], positions[-1])
+        ax.set_ylim(np.nanmin(low) - margin, np.nanmax(high) + margin)
+
+    def drawLines(self):
+        for name in self.names:
+            for line in self.lines[name]:
+                self.axes[name].draw_artist(line)
+
+    def onDraw(self, event):
+        """
+        Save the background after a full draw, the animated lines are
+        not part of it.
+        """
+        canvas = self.figure.canvas
+        if not getattr(canvas, 'supports_blit', True):
+            return
+        self.background = canvas.copy_from_bbox(self.figure.bbox)
+        self.drawLines()
+
+def showSeries(seriesList, titles=None, block=True):
+    """
+    Plot each series in its own subplot of a single figure.
+
+    @param  titles  list of (title, ylabel), one per series
+    """
+    names = range(len(seriesList))
+    if titles is None:
+        titles = [('', '')] * len(seriesList)
+    figure = LiveMetricsFigure(names, dict(zip(names, titles)), live=False)
+    figure.update(dict(zip(names, seriesList)))
+    plt.show(block=block)
+    return figure
@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015-2016, Xuyang Hu <xuyanghu@yahoo.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License version 2.1
+# as published by the Free Software Foundation
+
+"""
+stageTimer accumulates the time spent in the stages of the batch.
+
+The instrumented functions take an optional timer and only measure when
+it is given, so the cost when timing is off is one `is None` test per
+stage. Stages are timed back to back:
+
+    t = timer.start()
+    img = cv2.imread(path, 0)
+    t = timer.stop('decode', t)
+    ...
+    t = timer.stop('roi', t)
+"""
+
+from timeit import default_timer
+
+# pylint: disable=C0103,R0904,W0102,W0201
+
+# Stages in the order of the batch, others are reported after them
+STAGES = ('decode', 'roi', 'cacheRead', 'pad', 'filterBuild', 'fft',
+    'multiply', 'ifft', 'convert', 'cacheWrite', 'metrics')
+
+class StageTimer(object):
+    """
+    Total time and number of calls of named stages.
+
+    It only holds two dicts, so it can be sent to worker processes and
+    the times of the workers merged back with merge().
+    """
+
+    def __init__(self):
+        self.seconds = {}
+        self.counts = {}
+
+    def start(self):
+        return default_timer()
+
+    def stop(self, name, start):
+        """
+        Add the time since start to the stage name.
+
+        @return     the current time, the start of the next stage
+        """
+        now = default_timer()
+        self.add(name, now - start)
+        return now
+
+    def add(self, name, seconds, count=1):
+        self.seconds[name] = self.seconds.get(name, 0.0) + seconds
+        self.counts[name] = self.counts.get(name, 0) + count
+
+    def merge(self, times):
+        """
+        Add the times of another timer, given as its getTimes().
+        """
+        for name, (seconds, count) in times.items():
+            self.add(name, seconds, count)
+
+    def getTimes(self):
+        """
+        Return {stage name: (seconds, count)}.
+        """
+        return dict((name, (self.seconds[name], self.counts[name]))
+            for name in self.seconds)
+
+    def reset(self):
+        self.seconds.clear()
+        self.counts.clear()
+
+    def getNames(self):
+        """
+        Return the measured stages in batch order.
+        """
+        names = [name for name in STAGES if name in self.seconds]
+        return names + sorted(set(self.seconds) - set(names))
+
+    def getSummary(self):
+        """
+        Return {stage name: {'seconds', 'count', 'mean', 'percent'}},
+        'mean' is the time of one call and 'percent' the share of the
+        total time of all stages.
+        """
+        total = sum(self.seconds.values())
+        summary = {}
+        for name in self.seconds:
+            seconds = self.seconds[name]
+            count = self.counts[name]
+            summary[name] = {
+                'seconds': seconds,
+                'count': count,
+                'mean': seconds / count if count else 0.0,
+                'percent': 100.0 * seconds / total if total > 0 else 0.0}
+        return summary
+
+    def report(self):
+        """
+        Return the summary as a printable table.
+        """
+        summary = self.getSummary()
+        lines = ["%-12s %10s %8s %10s %7s" % ('stage', 'total ms', 'count',
+            'mean ms', '%')]
+        for name in self.getNames():
+            stage = summary[name]
+            lines.append("%-12s %10.1f %8d %10.3f %6.1f%%" % (name,
+                stage['seconds'] * 1000, stage['count'],
+                stage['mean'] * 1000, stage['percent']))
+        lines.append("%-12s %10.1f" % ('total',
+            sum(self.seconds.values()) * 1000))
+        return '\n'.join(lines)
@@ -0,0 +1,262 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015-2016, Xuyang Hu <xuyanghu@yahoo.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License version 2.1
+# as published by the Free Software Foundation
+
+"""
+thumbnailCache makes the thumbnails shown by FilePicker in the background.
+
+Thumbnails are decoded by a QThreadPool with QImageReader.setScaledSize,
+which lets the JPEG plugin decode at a reduced resolution instead of
+decoding the full frame and scaling it down. They are kept in a memory
+LRU and stored as small PNGs on disk for the next sessions, the least
+recently used ones are removed when the store grows over its cap.
+"""
+
+import collections
+import hashlib
+import os
+import threading
+
+from PySide import QtGui, QtCore
+
+# pylint: disable=C0103,R0904,W0102,W0201
+
+thumbnailDir = os.path.join(os.path.expanduser('~'), '.imagePicker',
+    'thumbnails')
+
+class ThumbnailSignals(QtCore.QObject):
+    """
+    Signals of ThumbnailTask, QRunnable is not a QObject.
+    """
+
+    # path, generation, thumbnail
+    loaded = QtCore.Signal(str, int, QtGui.QImage)
+    # path, generation of a thumbnail which could not be made
+    failed = QtCore.Signal(str, int)
+
+class ThumbnailTask(QtCore.QRunnable):
+    """
+    Load one thumbnail in a thread of the pool.
+    """
+
+    def __init__(self, cache, path, generation):
+        super(ThumbnailTask, self).__init__()
+        self.cache = cache
+        self.path = path
+        self.generation = generation
+
+    def run(self):
+        # The folder has changed since the request, skip the work
+        if self.generation != self.cache.generation:
+            return
+        image = self.cache.loadThumbnail(self.path)
+        if image is not None:
+            self.cache.signals.loaded.emit(self.path, self.generation, image)
+        else:
+            self.cache.signals.failed.emit(self.path, self.generation)
+
+class ThumbnailCache(QtCore.QObject):
+    """
+    Asynchronous thumbnail loader with a memory LRU and a disk store.
+
+    Call request(path) and wait for thumbnailReady(path), getIcon(path)
+    then returns the thumbnail. thumbnailFailed(path) is emitted instead
+    when the image cannot be read, a later request tries again. Only
+    QImage is used in the worker threads, the icons are made in the GUI
+    thread when they arrive.
+
+    The disk store is capped to maxStoreBytes like
+    imageCache.FilteredImageCache: the thumbnails read are touched, and
+    the least recently used ones (e.g. of images modified since) are
+    removed first.
+    """
+
+    # Emits the path of the image whose thumbnail is ready
+    thumbnailReady = QtCore.Signal(str)
+    # Emits the path of an image whose thumbnail could not be made
+    thumbnailFailed = QtCore.Signal(str)
+
+    def __init__(self, thumbSize=128, maxCount=1024, workers=2,
+            storeDir=thumbnailDir, maxStoreBytes=64 << 20, parent=None):
+        super(ThumbnailCache, self).__init__(parent)
+        self.thumbSize = thumbSize
+        self.maxCount = maxCount
+        self.storeDir = storeDir
+        self.maxStoreBytes = maxStoreBytes
+        self.generation = 0
+        # Bytes of the disk store, updated by the worker threads
+        self._storeLock = threading.Lock()
+        self.storeBytes = self.getStoreUsage()
+        if self.storeBytes > self.maxStoreBytes:
+            self.evictStored()
+
+        self.signals = ThumbnailSignals()
+        self.signals.loaded.connect(self.onLoaded)
+        self.signals.failed.connect(self.onFailed)
+        self.threadPool = QtCore.QThreadPool(self)
+        self.threadPool.setMaxThreadCount(workers)
+
+        self._icons = collections.OrderedDict()
+        self._pending = set()
+
+    def getIcon(self, path):
+        """
+        Return the thumbnail QIcon if it is in memory, None otherwise.
+        """
+        icon = self._icons.pop(path, None)
+        if icon is not None:
+            self._icons[path] = icon
+        return icon
+
+    def request(self, path):
+        """
+        Load the thumbnail of path in background (if not done yet).
+        """
+        if path in self._icons or path in self._pending:
+            return
+        self._pending.add(path)
+        self.threadPool.start(ThumbnailTask(self, path, self.generation))
+
+    def reset(self):
+        """
+        Forget the pending requests, e.g. when the folder changes.
+        Thumbnails already in memory are kept.
+        """
+        self.generation += 1
+        self._pending.clear()
+
+    def getStoredPath(self, path):
+        """
+        Return the path of the thumbnail in the disk store, or None if
+        the image does not exist. The thumbnail itself may not exist yet.
+        """
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        key = repr((os.path.abspath(path), stat.st_mtime, stat.st_size,
+            self.thumbSize))
+        return os.path.join(self.storeDir,
+            hashlib.sha1(key.encode('utf-8')).hexdigest() + '.png')
+
+    def loadThumbnail(self, path):
+        """
+        Return the thumbnail from the disk store, or decode it at reduced
+        size and store it. Runs in the worker threads.
+        """
+        storedPath = self.getStoredPath(path)
+        if storedPath is None:
+            return None
+        if os.path.isfile(storedPath):
+            image = QtGui.QImage(storedPath)
+            if not image.isNull():
+                try:
+                    # mtime tracks the last use for the eviction
+                    os.utime(storedPath, None)
+                except OSError:
+                    pass
+                return image
+
+        reader = QtGui.QImageReader(path)
+        size = reader.size()
+        if size.isValid():
+            size.scale(self.thumbSize, self.thumbSize,
+                QtCore.Qt.KeepAspectRatio)
+            reader.setScaledSize(size)
+        image = reader.read()
+        if image.isNull():
+            return None
+        if image.width() > self.thumbSize or image.height() > self.thumbSize:
+            image = image.scaled(self.thumbSize, self.thumbSize,
+                QtCore.Qt.KeepAspectRatio, QtCore.Qt.SmoothTransformation)
+
+        try:
+            if not os.path.isdir(self.storeDir):
+                os.makedirs(self.storeDir)
+            tmpPath = '%s.%d.tmp' % (storedPath,
+                threading.current_thread().ident)
+            if image.save(tmpPath, 'PNG'):
+                os.rename(tmpPath, storedPath)
+                self.addStoredBytes(os.path.getsize(storedPath))
+        except OSError:
+            # The disk store is only an optimization
+            pass
+        return image
+
+    def addStoredBytes(self, size):
+        """
+        Count a new stored thumbnail, and evict old ones when the store
+        is over maxStoreBytes.
+        """
+        with self._storeLock:
+            self.storeBytes += size
+            if self.storeBytes > self.maxStoreBytes:
+                self.evictStored()
+
+    def getStoredEntries(self):
+        """
+        Return [(mtime, size, path)] of the stored thumbnails.
+        """
+        if not os.path.isdir(self.storeDir):
+            return []
+        entries = []
+        for fileName in os.listdir(self.storeDir):
+            if not fileName.endswith('.png'):
+                continue
+            storedPath = os.path.join(self.storeDir, fileName)
+            try:
+                stat = os.stat(storedPath)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, storedPath))
+        return entries
+
+    def getStoreUsage(self):
+        """
+        Return the bytes used by the stored thumbnails.
+        """
+        return sum(entry[1] for entry in self.getStoredEntries())
+
+    def evictStored(self):
+        """
+        Remove the least recently used thumbnails until the store is
+        back under 90% of maxStoreBytes.
+        """
+        entries = sorted(self.getStoredEntries())
+        self.storeBytes = sum(entry[1] for entry in entries)
+        for mtime, size, storedPath in entries:
+            if self.storeBytes <= self.maxStoreBytes * 0.9:
+                break
+            try:
+                os.remove(storedPath)
+            except OSError:
+                pass
+            self.storeBytes -= size
+
+    @QtCore.Slot(str, int, QtGui.QImage)
+    def onLoaded(self, path, generation, image):
+        """
+        Receives the thumbnails in the GUI thread.
+        """
+        if generation != self.generation:
+            return
+        self._pending.discard(path)
+        self._icons[path] = QtGui.QIcon(QtGui.QPixmap.fromImage(image))
+        while len(self._icons) > self.maxCount:
+            self._icons.popitem(last=False)
+        self.thumbnailReady.emit(path)
+
+    @QtCore.Slot(str, int)
+    def onFailed(self, path, generation):
+        """
+        Forgets a failed request in the GUI thread, so it can be retried.
+        """
+        if generation != self.generation:
+            return
+        self._pending.discard(path)
+        self.thumbnailFailed.emit(path)